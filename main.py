@@ -1,10 +1,33 @@
-import tkinter as tk
-from src.ui.image_generator_ui import ImageGeneratorUI
+import argparse
 
 def main():
+    parser = argparse.ArgumentParser(description="NeyroTg - генератор изображений")
+    parser.add_argument('--server', action='store_true', help="запуск HTTP API сервера без интерфейса")
+    parser.add_argument('--bot', action='store_true', help="запуск Telegram бота")
+    parser.add_argument('--host', help="адрес API сервера")
+    parser.add_argument('--port', type=int, help="порт API сервера")
+    args = parser.parse_args()
+
+    if args.bot:
+        import asyncio
+        from src.bot.telegram_bot import TelegramBot
+        try:
+            asyncio.run(TelegramBot().run())
+        except KeyboardInterrupt:
+            pass
+        return
+
+    if args.server:
+        from src.server.api_server import ApiServer
+        ApiServer(host=args.host, port=args.port).serve_forever()
+        return
+
+    import tkinter as tk
+    from src.ui.image_generator_ui import ImageGeneratorUI
+
     root = tk.Tk()
     app = ImageGeneratorUI(root)
     root.mainloop()
 
 if __name__ == "__main__":
-    main()   
\ No newline at end of file
+    main()
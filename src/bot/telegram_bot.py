@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import collections
+from contextlib import asynccontextmanager
+import aiohttp
+from ..server.api_server import GenerationPipeline
+from ..services.scheduler import OverloadedError
+from ..utils.config import BOT_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Размер блока при потоковой отправке изображения
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+HELP_TEXT = (
+    "Отправьте описание - и я нарисую изображение.\n"
+    "/styles - список стилей\n"
+    "/style <название> - выбрать стиль\n"
+    "/enhance <текст> - улучшить описание\n"
+    "/create <текст> - перевести, улучшить и нарисовать"
+)
+
+class TelegramApiError(Exception):
+    """Ошибка, возвращенная Bot API"""
+
+    def __init__(self, code, description, retry_after=None):
+        super().__init__(f"{code}: {description}")
+        self.code = code
+        self.retry_after = retry_after
+
+class TelegramBot:
+    """Асинхронный Telegram бот: long polling, очередь заданий на каждый чат,
+    генерация в общем пуле потоков"""
+
+    def __init__(self, pipeline=None, token=None, api_base=None):
+        token = token or BOT_CONFIG['token']
+        if not token:
+            raise ValueError("Ошибка: не задан TELEGRAM_BOT_TOKEN")
+        self.api_url = f"{api_base or BOT_CONFIG['api_base']}/bot{token}"
+        self.pipeline = pipeline or GenerationPipeline(
+            workers=BOT_CONFIG['workers'], queue_size=BOT_CONFIG['queue_size']
+        )
+        self.session = None
+        self.offset = 0
+        self.chat_queues = {}
+        self.chat_workers = {}
+        self.chat_styles = {}
+        self.tasks = set()
+
+    async def call(self, method, payload=None, form=None, timeout=60):
+        """Один вызов метода Bot API"""
+        async with self.session.post(
+            f"{self.api_url}/{method}",
+            json=payload if form is None else None,
+            data=form,
+            timeout=aiohttp.ClientTimeout(total=timeout)
+        ) as response:
+            data = await response.json(content_type=None)
+        if not data.get('ok'):
+            raise TelegramApiError(
+                data.get('error_code', response.status),
+                data.get('description', ''),
+                (data.get('parameters') or {}).get('retry_after')
+            )
+        return data.get('result')
+
+    async def request(self, method, attempts=3, **payload):
+        """Вызов метода с повтором при ограничении частоты (429)"""
+        for attempt in range(attempts):
+            try:
+                return await self.call(method, payload)
+            except TelegramApiError as e:
+                if e.retry_after is None or attempt == attempts - 1:
+                    raise
+                await asyncio.sleep(e.retry_after)
+
+    async def send_message(self, chat_id, text):
+        try:
+            await self.request('sendMessage', chat_id=chat_id, text=text)
+        except Exception as e:
+            logger.error(f"Не удалось отправить сообщение в чат {chat_id}: {e}")
+
+    @asynccontextmanager
+    async def open_image(self, image_path):
+        """Открытие изображения из хранилища без блокировки цикла событий"""
+        loop = asyncio.get_running_loop()
+        context = self.pipeline.storage.open_image_file(image_path)
+        f = await loop.run_in_executor(None, context.__enter__)
+        try:
+            yield f
+        finally:
+            await loop.run_in_executor(None, context.__exit__, None, None, None)
+
+    async def read_chunks(self, f):
+        """Чтение файла блоками: изображение не загружается в память целиком"""
+        loop = asyncio.get_running_loop()
+        while True:
+            chunk = await loop.run_in_executor(None, f.read, UPLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    async def send_photo(self, chat_id, image_path, caption=None, attempts=3):
+        """Потоковая отправка изображения из хранилища"""
+        for attempt in range(attempts):
+            async with self.open_image(image_path) as f:
+                if f is None:
+                    raise FileNotFoundError(image_path)
+                form = aiohttp.FormData()
+                form.add_field('chat_id', str(chat_id))
+                if caption:
+                    form.add_field('caption', caption[:1024])
+                content_type = "image/jpeg" if image_path.endswith(('.jpg', '.jpeg')) else "image/png"
+                form.add_field('photo', self.read_chunks(f), filename=image_path, content_type=content_type)
+                try:
+                    return await self.call('sendPhoto', form=form, timeout=300)
+                except TelegramApiError as e:
+                    if e.retry_after is None or attempt == attempts - 1:
+                        raise
+                    retry_after = e.retry_after
+            await asyncio.sleep(retry_after)
+
+    async def run_blocking(self, chat_id, func, *args):
+        """Выполнение блокирующей операции в общем пуле; каждый чат - отдельный клиент планировщика"""
+        return await asyncio.wrap_future(self.pipeline.submit(func, *args, tenant=f"tg:{chat_id}"))
+
+    def spawn(self, coroutine):
+        """Фоновая задача со ссылкой, чтобы ее не удалил сборщик мусора"""
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return task
+
+    def dispatch(self, update):
+        """Разбор обновления; не ждет генерации, чтобы не задерживать опрос"""
+        message = update.get('message') or {}
+        text = (message.get('text') or '').strip()
+        chat_id = (message.get('chat') or {}).get('id')
+        if chat_id is None or not text:
+            return
+
+        command, _, argument = text.partition(' ')
+        command = command.split('@')[0].lower()
+        argument = argument.strip()
+        if command in ('/start', '/help'):
+            self.spawn(self.send_message(chat_id, HELP_TEXT))
+        elif command == '/styles':
+            styles = [name for name, data in self.pipeline.service.style_prompts.items() if data]
+            self.spawn(self.send_message(chat_id, "Доступные стили: " + ", ".join(styles)))
+        elif command == '/style':
+            if self.pipeline.service.style_prompts.get(argument):
+                self.chat_styles[chat_id] = argument
+                self.spawn(self.send_message(chat_id, f"Выбран стиль: {argument}"))
+            else:
+                self.spawn(self.send_message(chat_id, "Неизвестный стиль, см. /styles"))
+        elif command in ('/enhance', '/create'):
+            if argument:
+                self.enqueue(chat_id, command[1:], argument)
+        elif command.startswith('/'):
+            self.spawn(self.send_message(chat_id, HELP_TEXT))
+        else:
+            self.enqueue(chat_id, 'generate', text)
+
+    def enqueue(self, chat_id, kind, text):
+        """Постановка задания в очередь чата; задания одного чата выполняются по порядку"""
+        queue = self.chat_queues.setdefault(chat_id, collections.deque())
+        if len(queue) >= BOT_CONFIG['chat_queue_size']:
+            self.spawn(self.send_message(chat_id, "Слишком много заданий, дождитесь результата"))
+            return
+        queue.append((kind, text))
+        if chat_id not in self.chat_workers:
+            self.chat_workers[chat_id] = self.spawn(self.chat_worker(chat_id))
+
+    async def chat_worker(self, chat_id):
+        """Обработка очереди одного чата; завершается, когда очередь пуста"""
+        queue = self.chat_queues[chat_id]
+        try:
+            while queue:
+                kind, text = queue.popleft()
+                try:
+                    if kind == 'enhance':
+                        await self.handle_enhance(chat_id, text)
+                    else:
+                        await self.handle_generate(chat_id, text, enhance=kind == 'create')
+                except OverloadedError:
+                    await self.send_message(chat_id, "Сервис перегружен, повторите позже")
+                except Exception as e:
+                    logger.error(f"Ошибка обработки задания чата {chat_id}: {e}")
+                    await self.send_message(chat_id, f"Ошибка: {e}")
+        finally:
+            # Между проверкой очереди и удалением нет await, поэтому задания не теряются
+            del self.chat_workers[chat_id]
+            if not queue:
+                del self.chat_queues[chat_id]
+
+    async def handle_generate(self, chat_id, text, enhance=False):
+        self.spawn(self.request('sendChatAction', attempts=1, chat_id=chat_id, action='upload_photo'))
+        style = self.chat_styles.get(chat_id, 'default')
+        result = await self.run_blocking(chat_id, self.pipeline.generate, text, style, 'png', True, enhance)
+        await self.send_photo(chat_id, result['image_path'], result.get('revised_prompt') or text)
+
+    async def handle_enhance(self, chat_id, text):
+        self.spawn(self.request('sendChatAction', attempts=1, chat_id=chat_id, action='typing'))
+        style = self.chat_styles.get(chat_id, 'default')
+        result = await self.run_blocking(chat_id, self.pipeline.service.generate_description, text, style)
+        await self.send_message(chat_id, result)
+
+    async def poll(self):
+        """Long polling обновлений"""
+        timeout = BOT_CONFIG['poll_timeout']
+        while True:
+            try:
+                updates = await self.call(
+                    'getUpdates',
+                    {'offset': self.offset, 'timeout': timeout, 'allowed_updates': ['message']},
+                    timeout=timeout + 10
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка получения обновлений: {e}")
+                await asyncio.sleep(getattr(e, 'retry_after', None) or 3)
+                continue
+            for update in updates:
+                self.offset = max(self.offset, update['update_id'] + 1)
+                try:
+                    self.dispatch(update)
+                except Exception as e:
+                    logger.error(f"Ошибка разбора обновления: {e}")
+
+    async def run(self):
+        """Запуск бота до отмены"""
+        connector = aiohttp.TCPConnector(limit=BOT_CONFIG['connections'])
+        self.session = aiohttp.ClientSession(connector=connector)
+        logger.info("Telegram бот запущен")
+        try:
+            await self.poll()
+        finally:
+            for task in list(self.tasks):
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            await self.session.close()
+            self.pipeline.shutdown()
@@ -0,0 +1,302 @@
+import os
+import json
+import shutil
+import logging
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from ..services.image_service import ImageService
+from ..services.scheduler import FairScheduler, OverloadedError, INTERACTIVE, BATCH, PRIORITIES
+from ..services.circuit_breaker import CircuitOpenError
+from ..utils.image_storage import ImageStorage
+from ..utils.retention import RetentionManager
+from ..utils.config import SERVER_CONFIG, SCHEDULER_CONFIG
+from ..utils.profiler import profiler
+
+logger = logging.getLogger(__name__)
+
+# Форматы сохранения генерации
+SAVE_FORMATS = ('png', 'jpeg')
+
+# Отдаваемые по /images/ файлы: расширение -> Content-Type
+IMAGE_CONTENT_TYPES = {
+    '.png': "image/png",
+    '.jpg': "image/jpeg",
+    '.jpeg': "image/jpeg",
+    '.webp': "image/webp"
+}
+
+class ApiError(Exception):
+    """Ошибка запроса с HTTP-статусом"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class GenerationPipeline:
+    """Общий для всех клиентов конвейер: один сервис, одно хранилище
+    и пул исполнителей со справедливой очередью"""
+
+    def __init__(self, service=None, storage=None, workers=None, queue_size=None):
+        self.service = service or ImageService()
+        self.storage = storage or ImageStorage()
+        self.workers = workers or SERVER_CONFIG['workers']
+        self.queue_size = queue_size if queue_size is not None else SERVER_CONFIG['queue_size']
+        self.scheduler = FairScheduler(
+            self.workers,
+            max_queued=self.queue_size,
+            tenant_limit=SCHEDULER_CONFIG['tenant_concurrency'],
+            tenant_queue=SCHEDULER_CONFIG['tenant_queue'],
+            interactive_reserve=SCHEDULER_CONFIG['interactive_reserve'],
+            name="api"
+        )
+        # Дисковая квота соблюдается и без интерфейса (режимы --server и --bot)
+        self.retention = RetentionManager(self.storage)
+        self.retention.start()
+        # Пока API недоступно, фоновые задания ждут в очереди, а не расходуют попытки
+        self.service.add_health_listener(self.on_health_change)
+        # При NEYROTG_PROFILE=1 профили пишутся и в режиме сервера
+        profiler.wrap_methods(self, 'generate')
+        profiler.wrap_methods(self.storage, 'save_image')
+
+    def on_health_change(self, endpoint, state, retry_after):
+        self.scheduler.pause(BATCH, max(self.service.retry_after(name) for name in self.service.breakers))
+
+    def submit(self, func, *args, tenant="local", priority=INTERACTIVE):
+        """Постановка задания в очередь клиента; при переполнении - OverloadedError"""
+        return self.scheduler.submit(func, *args, tenant=tenant, priority=priority)
+
+    def stats(self):
+        return {'queue_size': self.queue_size, **self.scheduler.stats(),
+                'api': self.service.health(), 'hedging': self.service.hedging_stats()}
+
+    def shutdown(self):
+        self.scheduler.shutdown()
+
+    def generate(self, description, style="default", format="png", reuse=False, enhance=False):
+        """Генерация (или повторное использование) и сохранение изображения.
+        С enhance описание сначала переводится и улучшается одним запросом"""
+        if enhance:
+            description = self.service.prepare_prompt(description, style)
+        cache_key = self.service.make_cache_key(description, style, format)
+        if reuse:
+            cached_index = self.storage.find_cached(cache_key)
+            if cached_index is not None:
+                entry = self.storage.get_history()[cached_index]
+                return {'image_path': entry['image_path'], 'cached': True, 'prompt': description}
+
+        retry_after = self.service.retry_after("images")
+        if retry_after:
+            raise CircuitOpenError("images", retry_after)
+        image_url, generation_info = self.service.generate_image_with_info(description, style)
+        if not image_url:
+            raise ApiError(502, "Не удалось сгенерировать изображение")
+        image_path = self.storage.save_image(image_url, description, format, cache_key, generation_info)
+        if not image_path:
+            raise ApiError(502, "Не удалось сохранить изображение")
+        self.retention.trigger()
+        return {
+            'image_path': os.path.basename(image_path),
+            'cached': False,
+            'prompt': description,
+            'revised_prompt': generation_info.get('revised_prompt')
+        }
+
+class ApiRequestHandler(BaseHTTPRequestHandler):
+    """Обработчик HTTP-запросов API"""
+
+    protocol_version = "HTTP/1.1"
+    pipeline = None
+    # Сколько ждать результата задания, секунд
+    result_timeout = 300
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status, data, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            data = json.loads(self.rfile.read(length))
+        except ValueError:
+            raise ApiError(400, "Некорректный JSON")
+        if not isinstance(data, dict):
+            raise ApiError(400, "Ожидается JSON-объект")
+        return data
+
+    def _text(self, data, name, default=''):
+        """Строковое поле запроса без пробелов по краям; иной тип - 400"""
+        value = data.get(name, default)
+        if value is None:
+            value = default
+        if not isinstance(value, str):
+            raise ApiError(400, f"Поле {name} должно быть строкой")
+        return value.strip()
+
+    def _style(self, data):
+        style = self._text(data, 'style', 'default')
+        if style not in self.pipeline.service.style_prompts:
+            raise ApiError(400, f"Неизвестный стиль: {style}")
+        return style
+
+    def _run(self, func, *args):
+        """Выполнение задания в очереди клиента с ожиданием результата.
+        Клиент - заголовок X-Tenant или адрес, приоритет - X-Priority"""
+        tenant = self.headers.get("X-Tenant") or self.client_address[0]
+        priority = (self.headers.get("X-Priority") or INTERACTIVE).lower()
+        if priority not in PRIORITIES:
+            raise ApiError(400, f"Неизвестный приоритет: {priority}")
+        future = self.pipeline.submit(func, *args, tenant=tenant, priority=priority)
+        try:
+            return future.result(timeout=self.result_timeout)
+        except FutureTimeoutError:
+            # Задание из очереди снимается; уже запущенное завершится и попадет в историю
+            if future.cancel():
+                raise ApiError(504, "Задание не дождалось очереди, повторите позже")
+            raise ApiError(504, "Генерация не завершилась вовремя, результат появится в /history")
+
+    def _handle(self, routes):
+        path = urlparse(self.path).path
+        try:
+            for prefix, handler in routes:
+                if path == prefix or (prefix.endswith('/') and path.startswith(prefix)):
+                    handler(path)
+                    return
+            raise ApiError(404, "Не найдено")
+        except OverloadedError:
+            self._send_json(429, {'error': "Сервер перегружен, повторите позже"}, {"Retry-After": "5"})
+        except CircuitOpenError as e:
+            self._send_json(503, {'error': str(e)}, {"Retry-After": str(max(1, round(e.retry_after)))})
+        except ApiError as e:
+            self._send_json(e.status, {'error': str(e)})
+        except Exception as e:
+            logger.error(f"Ошибка обработки запроса {path}: {e}")
+            self._send_json(500, {'error': str(e)})
+
+    def do_GET(self):
+        self._handle([
+            ("/health", self.get_health),
+            ("/history", self.get_history),
+            ("/images/", self.get_image)
+        ])
+
+    def do_POST(self):
+        self._handle([
+            ("/generate", self.post_generate),
+            ("/enhance", self.post_enhance),
+            ("/translate", self.post_translate)
+        ])
+
+    def get_health(self, path):
+        self._send_json(200, {'status': 'ok', **self.pipeline.stats()})
+
+    def get_history(self, path):
+        query = parse_qs(urlparse(self.path).query)
+        try:
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query.get('limit', ['50'])[0])
+        except ValueError:
+            raise ApiError(400, "offset и limit должны быть целыми числами")
+        if offset < 0 or limit < 0:
+            raise ApiError(400, "offset и limit не могут быть отрицательными")
+        limit = min(limit, 500)
+        history = self.pipeline.storage.get_history()
+        self._send_json(200, {'total': len(history), 'items': history[offset:offset + limit]})
+
+    def get_image(self, path):
+        name = path[len("/images/"):]
+        if not name or '/' in name or '\\' in name or name.startswith('.'):
+            raise ApiError(400, "Некорректное имя файла")
+        # В каталоге лежат и служебные файлы (история, индексы, блокировки) - отдаем только изображения
+        extension = os.path.splitext(name)[1].lower()
+        if extension not in IMAGE_CONTENT_TYPES:
+            raise ApiError(404, "Изображение не найдено")
+        with self.pipeline.storage.open_image_file(name) as f:
+            if f is None:
+                raise ApiError(404, "Изображение не найдено")
+            size = f.seek(0, 2)
+            f.seek(0)
+            self.send_response(200)
+            self.send_header("Content-Type", IMAGE_CONTENT_TYPES[extension])
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile, 64 * 1024)
+
+    def post_generate(self, path):
+        data = self._read_json()
+        description = self._text(data, 'description')
+        if not description:
+            raise ApiError(400, "Не указано описание")
+        format = self._text(data, 'format', 'png')
+        if format not in SAVE_FORMATS:
+            raise ApiError(400, f"Формат должен быть одним из: {', '.join(SAVE_FORMATS)}")
+        result = self._run(
+            self.pipeline.generate,
+            description,
+            self._style(data),
+            format,
+            bool(data.get('reuse', False)),
+            bool(data.get('enhance', False))
+        )
+        self._send_json(200, result)
+
+    def post_enhance(self, path):
+        data = self._read_json()
+        text = self._text(data, 'text')
+        if not text:
+            raise ApiError(400, "Не указан текст")
+        result = self._run(self.pipeline.service.generate_description, text, self._style(data))
+        self._send_json(200, {'text': result})
+
+    def post_translate(self, path):
+        data = self._read_json()
+        text = self._text(data, 'text')
+        langs = data.get('langs') or ([data['lang']] if data.get('lang') else [])
+        if not isinstance(langs, list) or not all(isinstance(lang, str) and lang for lang in langs):
+            raise ApiError(400, "langs должен быть списком кодов языков")
+        if not text or not langs:
+            raise ApiError(400, "Не указан текст или языки")
+        result = self._run(self.pipeline.service.translate_batch, text, langs)
+        self._send_json(200, {'translations': result})
+
+class ApiServer:
+    """HTTP API поверх общего конвейера генерации"""
+
+    def __init__(self, pipeline=None, host=None, port=None):
+        self.pipeline = pipeline or GenerationPipeline()
+        handler = type("BoundApiRequestHandler", (ApiRequestHandler,), {'pipeline': self.pipeline})
+        self.httpd = ThreadingHTTPServer(
+            (host or SERVER_CONFIG['host'], SERVER_CONFIG['port'] if port is None else port),
+            handler
+        )
+        self.httpd.daemon_threads = True
+
+    @property
+    def address(self):
+        return self.httpd.server_address
+
+    def serve_forever(self):
+        logger.info("API сервер запущен на http://%s:%s", *self.address[:2])
+        self.httpd.serve_forever()
+
+    def start(self):
+        """Запуск в фоновом потоке"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def shutdown(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
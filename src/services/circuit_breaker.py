@@ -0,0 +1,111 @@
+import time
+import threading
+import collections
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitOpenError(Exception):
+    """Запрос отклонен без обращения к API: точка доступа считается недоступной"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"API {name} временно недоступно, повтор через {retry_after:.0f} с")
+        self.name = name
+        self.retry_after = retry_after
+
+class CircuitBreaker:
+    """Автоматический выключатель для одной точки доступа API.
+
+    Считает долю неудачных и слишком медленных вызовов в скользящем окне.
+    При превышении порога размыкается: вызовы сразу отклоняются в течение
+    open_timeout, затем пропускается пробный вызов (полуоткрытое состояние),
+    и по его результату выключатель замыкается или снова размыкается."""
+
+    def __init__(self, name, failure_rate=0.5, window=20, min_calls=5,
+                 slow_call_seconds=None, open_timeout=30):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.slow_call_seconds = slow_call_seconds
+        self.open_timeout = open_timeout
+        self.lock = threading.Lock()
+        self.outcomes = collections.deque(maxlen=window)
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.listeners = []
+
+    def add_listener(self, callback):
+        """callback(name, state, retry_after) вызывается при смене состояния"""
+        self.listeners.append(callback)
+
+    def _set_state(self, state):
+        # Вызывается под блокировкой; слушатели уведомляются после нее
+        self.state = state
+        if state == OPEN:
+            self.opened_at = time.monotonic()
+        elif state == CLOSED:
+            self.outcomes.clear()
+        self.trial_in_flight = False
+        return state
+
+    def _notify(self, state):
+        retry_after = self.retry_after()
+        for callback in self.listeners:
+            try:
+                callback(self.name, state, retry_after)
+            except Exception:
+                pass
+
+    def retry_after(self):
+        """Секунд до пробного вызова; 0, если вызовы разрешены"""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.open_timeout - time.monotonic())
+
+    def allow(self, probe=True):
+        """Можно ли выполнять вызов прямо сейчас.
+        probe=False - второстепенный вызов: только при замкнутом выключателе,
+        пробный вызов он не занимает"""
+        if not probe:
+            with self.lock:
+                return self.state == CLOSED
+        changed = None
+        with self.lock:
+            if self.state == OPEN and time.monotonic() >= self.opened_at + self.open_timeout:
+                changed = self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                # В полуоткрытом состоянии пропускается только один пробный вызов
+                allowed = not self.trial_in_flight
+                self.trial_in_flight = True
+            else:
+                allowed = self.state == CLOSED
+        if changed:
+            self._notify(changed)
+        return allowed
+
+    def record(self, success, latency=None):
+        """Учет результата вызова"""
+        if success and latency is not None and self.slow_call_seconds and latency > self.slow_call_seconds:
+            success = False
+        changed = None
+        with self.lock:
+            if self.state == HALF_OPEN:
+                changed = self._set_state(CLOSED if success else OPEN)
+            elif self.state == CLOSED:
+                self.outcomes.append(success)
+                failures = self.outcomes.count(False)
+                if len(self.outcomes) >= self.min_calls and failures / len(self.outcomes) >= self.failure_rate:
+                    changed = self._set_state(OPEN)
+        if changed:
+            self._notify(changed)
+
+    def snapshot(self):
+        with self.lock:
+            calls = len(self.outcomes)
+            return {
+                'state': self.state,
+                'failure_rate': round(self.outcomes.count(False) / calls, 3) if calls else 0.0,
+                'retry_after': round(self.retry_after(), 1)
+            }
@@ -0,0 +1,69 @@
+import threading
+import collections
+
+class HedgingPolicy:
+    """Политика дублирования медленных запросов.
+
+    Порог задержки - заданный квантиль (по умолчанию p95) последних успешных
+    ответов. Если запрос не завершился за это время, отправляется копия;
+    доля дублей среди последних запросов ограничена max_extra_rate."""
+
+    def __init__(self, enabled=False, quantile=0.95, min_samples=20, window=200,
+                 max_extra_rate=0.1, min_delay=0.5):
+        self.enabled = enabled
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.max_extra_rate = max_extra_rate
+        self.min_delay = min_delay
+        self.lock = threading.Lock()
+        self.latencies = collections.deque(maxlen=window)
+        self.recent = collections.deque(maxlen=window)
+        self.hedges_in_flight = 0
+        self.requests = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+
+    def record_latency(self, latency):
+        """Задержка успешного ответа одной попытки"""
+        with self.lock:
+            self.latencies.append(latency)
+
+    def delay(self):
+        """Через сколько секунд дублировать запрос; None - данных пока мало"""
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        position = min(int(len(ordered) * self.quantile), len(ordered) - 1)
+        return max(ordered[position], self.min_delay)
+
+    def try_hedge(self):
+        """Разрешение на дубль с учетом ограничения доли лишних запросов"""
+        with self.lock:
+            hedged = sum(self.recent) + self.hedges_in_flight
+            if hedged + 1 > self.max_extra_rate * max(len(self.recent), self.min_samples):
+                return False
+            self.hedges_fired += 1
+            self.hedges_in_flight += 1
+            return True
+
+    def record_request(self, hedged, hedge_won=False):
+        """Итог запроса: был ли дубль и вернулся ли он первым"""
+        with self.lock:
+            self.requests += 1
+            self.recent.append(hedged)
+            if hedged:
+                self.hedges_in_flight -= 1
+            if hedge_won:
+                self.hedges_won += 1
+
+    def stats(self):
+        current_delay = self.delay()
+        with self.lock:
+            return {
+                'enabled': self.enabled,
+                'requests': self.requests,
+                'hedges_fired': self.hedges_fired,
+                'hedges_won': self.hedges_won,
+                'delay': round(current_delay, 3) if current_delay is not None else None
+            }
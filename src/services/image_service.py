@@ -1,6 +1,18 @@
 import requests
 import logging
-from ..utils.config import OPENAI_API_KEY, IMAGES_DIR
+import hashlib
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from ..utils.config import (
+    require_api_key, OPENAI_API_BASE, IMAGES_DIR, IMAGE_CONFIG, TRANSLATION_TIMEOUT, RATE_LIMITS,
+    BREAKER_CONFIG, HEDGING_CONFIG
+)
+from .rate_limiter import RateLimiter
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .hedging import HedgingPolicy
+from .prompt_compiler import PromptCompiler, normalize_whitespace, estimate_tokens
 import os
 
 # Настройка логирования
@@ -10,13 +22,79 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Запрос улучшения описания; пробелы нормализуются один раз при загрузке
+DESCRIPTION_TEMPLATE = normalize_whitespace("""
+    Как эксперт по стилю {style}, создай краткое но ёмкое описание для генерации изображения на основе: "{text}"
+    Требования:
+    1. Сохрани основную идею, сделав её более яркой.
+    2. Добавь 10-15 ключевых деталей: объекты и их характеристики, цвета и освещение, композиция и настроение, характерные элементы стиля, детали окружения.
+    3. Учти особенности стиля: {style_features}.
+    4. Добавь 2-3 неожиданных, но уместных детали и интересные художественные приёмы, создай запоминающуюся композицию.
+    Создай лаконичное но эффектное описание:
+""")
+
+# Перевод на английский и улучшение описания одним запросом
+PROMPT_TEMPLATE = normalize_whitespace("""
+    You write prompts for the DALL-E image model in the style "{style}".
+    Translate the user's description below into English if needed and turn it into a vivid, concise image prompt:
+    keep the main idea, add 10-15 key details (objects, colors, lighting, composition, mood, environment)
+    and 2-3 unexpected but fitting details. Style features: {style_features}.
+    Reply with the English prompt only, without quotes or explanations.
+    Description: "{text}"
+""")
+
+# Chat-операции с дублированием медленных запросов; у каждой своя политика
+HEDGED_OPERATIONS = ('description', 'prepare_prompt', 'translate', 'translate_batch')
+
+# Названия языков для промптов перевода
+LANGUAGE_NAMES = {
+    "en": "английский",
+    "ru": "русский",
+    "es": "испанский",
+    "fr": "французский",
+    "de": "немецкий",
+    "ja": "японский",
+    "zh": "китайский"
+}
+
 class ImageService:
     def __init__(self):
         self.headers = {
             "Content-Type": "application/json",
-            "Authorization": f"Bearer {OPENAI_API_KEY}"
+            "Authorization": f"Bearer {require_api_key()}"
+        }
+        
+        # Общие для всех потоков ограничители частоты запросов
+        self.rate_limiters = {
+            "images": RateLimiter(RATE_LIMITS['images']),
+            "chat": RateLimiter(RATE_LIMITS['chat'])
+        }
+        
+        # Выключатели: при недоступности API запросы отклоняются сразу, без ожидания таймаута
+        self.breakers = {
+            endpoint: CircuitBreaker(endpoint, **settings) for endpoint, settings in BREAKER_CONFIG.items()
         }
         
+        # Дублирование медленных chat-запросов для снижения хвостовой задержки.
+        # Задержки операций сильно различаются, поэтому порог у каждой свой
+        self.hedging = {operation: HedgingPolicy(**HEDGING_CONFIG) for operation in HEDGED_OPERATIONS}
+        self.hedge_executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+        
+        # Стили компилируются один раз: без лишних пробелов и повторов
+        self.prompt_compiler = PromptCompiler()
+        
+        # Учет токенов запросов к API
+        self.token_usage = {"prompt": 0, "completion": 0, "image_prompt_estimated": 0}
+        self.usage_lock = threading.Lock()
+        
+        # Ожидание ограничителя частоты последним запросом потока:
+        # вычитается из задержки, чтобы метрики отражали время ответа API
+        self.request_state = threading.local()
+        
+        # Кеш переводов: (текст, язык) -> перевод
+        self.translation_cache = {}
+        self.cache_lock = threading.Lock()
+        
         # Стили для изображений с экспертными промптами
         self.style_prompts = {
             "default": {
@@ -124,44 +202,224 @@ class ImageService:
             logger.error(f"Ошибка при сохранении кастомного стиля: {e}")
             return False
 
-    def generate_image(self, description, style="default"):
-        """Генерация изображения с учетом стиля"""
+    def _post(self, endpoint, path, payload, timeout=None, probe=True):
+        """POST-запрос к OpenAI API с учетом общего ограничения частоты.
+        Если выключатель точки доступа разомкнут - сразу CircuitOpenError;
+        probe=False - запрос не может быть пробным после сбоя API"""
+        breaker = self.breakers[endpoint]
+        if not breaker.allow(probe):
+            raise CircuitOpenError(endpoint, breaker.retry_after())
+        waiting = time.perf_counter()
+        self.rate_limiters[endpoint].acquire()
+        started = time.perf_counter()
+        self.request_state.limiter_wait = started - waiting
         try:
-            # Получаем стиль
-            style_data = self.style_prompts.get(style)
-            if not style_data:
-                style_data = self.style_prompts["default"]
-            
-            # Формируем промпт
-            prefix = style_data["prefix"]
-            suffix = style_data["suffix"]
-            
-            # Собираем полный промпт
-            full_prompt = f"{prefix} {description}. {suffix}"
-            
-            logger.info(f"Генерация изображения. Промпт: {full_prompt}")
-            
-            payload = {
-                "model": "dall-e-3",
-                "prompt": full_prompt,
-                "n": 1,
-                "size": "1024x1024",
-                "quality": "standard"
-            }
-            
             response = requests.post(
-                "https://api.openai.com/v1/images/generations",
+                f"{OPENAI_API_BASE}{path}",
                 headers=self.headers,
-                json=payload
+                json=payload,
+                timeout=timeout
             )
+        except Exception:
+            breaker.record(False)
+            raise
+        # Ошибки сервера и перегрузка говорят о сбое API, ошибки в запросе - нет
+        healthy = response.status_code < 500 and response.status_code != 429
+        breaker.record(healthy, time.perf_counter() - started)
+        return response
+
+    def _timed_post(self, policy, endpoint, path, payload, timeout):
+        """Одна попытка запроса с учетом задержки успешного ответа в политике операции"""
+        started = time.perf_counter()
+        response = self._post(endpoint, path, payload, timeout)
+        if response.status_code == 200:
+            policy.record_latency(time.perf_counter() - started - self.limiter_wait())
+        return response
+
+    def _post_hedged(self, operation, endpoint, path, payload, timeout=None):
+        """POST-запрос с дублированием: если ответа нет дольше изученного
+        порога, отправляется копия и берется ответ, пришедший первым.
+        Запрос requests нельзя прервать, поэтому отставшая попытка
+        просто отбрасывается после завершения"""
+        policy = self.hedging[operation]
+        if not policy.enabled:
+            return self._post(endpoint, path, payload, timeout)
+        
+        delay = policy.delay()
+        if delay is None:
+            policy.record_request(False)
+            return self._timed_post(policy, endpoint, path, payload, timeout)
+        
+        primary = self.hedge_executor.submit(self._timed_post, policy, endpoint, path, payload, timeout)
+        done, _ = wait([primary], timeout=delay)
+        if done or not policy.try_hedge():
+            policy.record_request(False)
+            return primary.result()
+        
+        logger.info(f"Запрос {path} дольше {delay:.2f} с, отправляем дубль")
+        hedge = self.hedge_executor.submit(self._timed_post, policy, endpoint, path, payload, timeout)
+        pending = {primary, hedge}
+        first_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    first_error = first_error or e
+                    continue
+                # Ошибка сервера у одной попытки - ждем вторую
+                if response.status_code >= 500 and pending:
+                    continue
+                policy.record_request(True, hedge_won=future is hedge)
+                for other in pending:
+                    other.cancel()
+                return response
+        policy.record_request(True)
+        if first_error is not None:
+            raise first_error
+        return primary.result()
+
+    def limiter_wait(self):
+        """Секунд ожидания ограничителя частоты в последнем запросе текущего потока"""
+        return getattr(self.request_state, 'limiter_wait', 0.0)
+
+    def hedging_stats(self):
+        """Статистика дублирования по операциям"""
+        return {operation: policy.stats() for operation, policy in self.hedging.items()}
+
+    def health(self):
+        """Состояние выключателей по точкам доступа"""
+        return {endpoint: breaker.snapshot() for endpoint, breaker in self.breakers.items()}
+
+    def add_health_listener(self, callback):
+        """callback(endpoint, state, retry_after) при смене состояния любого выключателя"""
+        for breaker in self.breakers.values():
+            breaker.add_listener(callback)
+
+    def retry_after(self, endpoint):
+        """Секунд до следующей попытки обращения к точке доступа; 0 - можно сейчас"""
+        return self.breakers[endpoint].retry_after()
+
+    def _record_usage(self, kind, data, estimated):
+        """Учет токенов chat-запроса по полю usage ответа"""
+        usage = data.get('usage') or {}
+        with self.usage_lock:
+            self.token_usage["prompt"] += usage.get('prompt_tokens', estimated)
+            self.token_usage["completion"] += usage.get('completion_tokens', 0)
+        logger.info(
+            f"{kind}: токенов промпта ~{estimated} (оценка), "
+            f"{usage.get('prompt_tokens', '?')} (API), ответа {usage.get('completion_tokens', '?')}"
+        )
+
+    def get_style(self, style):
+        """Данные стиля; неизвестный или пустой стиль заменяется стандартным"""
+        return self.style_prompts.get(style) or self.style_prompts["default"]
+
+    def compile_prompt(self, description, style="default", limit=None):
+        """Промпт для DALL-E с учетом лимита длины. Возвращает (промпт, обрезан ли он)"""
+        return self.prompt_compiler.build(
+            self.get_style(style), description, limit or IMAGE_CONFIG['prompt_limit']
+        )
+
+    def build_prompt(self, description, style="default", limit=None):
+        """Сборка полного промпта для DALL-E с учетом стиля"""
+        return self.compile_prompt(description, style, limit)[0]
+
+    def make_cache_key(self, description, style="default", format="png"):
+        """Ключ повторного использования: хеш промпта, стиля и параметров генерации"""
+        key_data = {
+            "prompt": self.build_prompt(description, style),
+            "style": style,
+            "model": IMAGE_CONFIG['model'],
+            "size": IMAGE_CONFIG['size'],
+            "quality": IMAGE_CONFIG['quality'],
+            "format": format.lower()
+        }
+        raw = json.dumps(key_data, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def generate_image(self, description, style="default"):
+        """Генерация изображения с учетом стиля"""
+        return self.generate_image_with_info(description, style)[0]
+
+    def generate_image_with_info(self, description, style="default"):
+        """Генерация изображения, возвращает URL и параметры запроса с задержкой API"""
+        full_prompt, truncated = self.compile_prompt(description, style)
+        prompt_tokens = estimate_tokens(full_prompt)
+        with self.usage_lock:
+            self.token_usage["image_prompt_estimated"] += prompt_tokens
+        
+        logger.info(f"Генерация изображения (~{prompt_tokens} токенов). Промпт: {full_prompt}")
+        if truncated:
+            logger.warning("Промпт сокращен до лимита длины модели")
+        
+        payload = {
+            "model": IMAGE_CONFIG['model'],
+            "prompt": full_prompt,
+            "n": 1,
+            "size": IMAGE_CONFIG['size'],
+            "quality": IMAGE_CONFIG['quality']
+        }
+        
+        self.request_state.limiter_wait = 0.0
+        started = time.perf_counter()
+        data = self._request_image(payload)
+        elapsed = time.perf_counter() - started
+        limiter_wait = self.limiter_wait()
+        info = {
+            "style": style,
+            "model": IMAGE_CONFIG['model'],
+            "size": IMAGE_CONFIG['size'],
+            "quality": IMAGE_CONFIG['quality'],
+            "latency": round(elapsed - limiter_wait, 3),
+            "limiter_wait": round(limiter_wait, 3),
+            "prompt_tokens": prompt_tokens,
+            "prompt_truncated": truncated
+        }
+        if not data:
+            return None, info
+        info["revised_prompt"] = data.get('revised_prompt')
+        return data['url'], info
+
+    def generate_draft(self, description, style="default"):
+        """Быстрая генерация черновика низкого разрешения"""
+        # У младшей модели более строгий лимит длины промпта
+        full_prompt = self.build_prompt(description, style, IMAGE_CONFIG['draft_prompt_limit'])
+        
+        logger.info("Генерация черновика изображения")
+        
+        payload = {
+            "model": IMAGE_CONFIG['draft_model'],
+            "prompt": full_prompt,
+            "n": 1,
+            "size": IMAGE_CONFIG['draft_size']
+        }
+        # Черновик идет только при исправном API: пробный вызов после сбоя
+        # должен достаться финальному изображению
+        try:
+            data = self._request_image(payload, probe=False)
+        except CircuitOpenError:
+            logger.info("Черновик пропущен: API восстанавливается после сбоя")
+            return None
+        return data['url'] if data else None
+
+    def _request_image(self, payload, probe=True):
+        """Запрос к API генерации изображений, возвращает описание изображения из ответа или None.
+        При разомкнутом выключателе - CircuitOpenError"""
+        try:
+            response = self._post("images", "/images/generations", payload, probe=probe)
             
             if response.status_code == 200:
-                return response.json()['data'][0]['url']
+                return response.json()['data'][0]
             else:
                 error_data = response.json()
                 error_message = error_data.get('error', {}).get('message', 'Неизвестная ошибка')
                 logger.error(f"Ошибка API при генерации изображения: {response.status_code}, {error_message}")
                 return None
+        except CircuitOpenError:
+            # Вызывающий показывает отдельное сообщение о недоступности API
+            raise
         except Exception as e:
             logger.error(f"Ошибка при генерации изображения: {str(e)}")
             return None
@@ -169,47 +427,21 @@ class ImageService:
     def generate_description(self, text: str, style: str = "default") -> str:
         """Генерирует улучшенное описание для изображения с учетом стиля"""
         try:
-            # Получаем данные стиля
-            style_data = self.style_prompts.get(style, self.style_prompts["default"])
-            if not style_data:
-                style_data = self.style_prompts["default"]
-
-            # Формируем запрос для GPT с учетом стиля
-            prompt = f"""Как эксперт по стилю {style}, создай краткое но ёмкое описание для генерации изображения на основе: "{text}"
-
-Требования:
-1. Сохрани основную идею, сделав её более яркой
-
-2. Добавь ключевые детали (10-15 элементов):
-   - Основные объекты и их характеристики
-   - Цвета и освещение
-   - Композиция и настроение
-   - Характерные элементы стиля
-   - Важные детали окружения
-
-3. Учти особенности стиля: {style_data['suffix']}
-
-4. Сделай описание креативным:
-   - Добавь 2-3 неожиданных, но уместных детали
-   - Используй интересные художественные приёмы
-   - Создай запоминающуюся композицию
-
-Создай лаконичное но эффектное описание:"""
+            # В запрос идет только сжатый перечень особенностей стиля
+            compiled = self.prompt_compiler.compile_style(self.get_style(style))
+            prompt = DESCRIPTION_TEMPLATE.format(style=style, text=text, style_features=compiled.brief)
             
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=self.headers,
-                json={
-                    "model": "gpt-4",
-                    "messages": [{"role": "user", "content": prompt}],
-                    "max_tokens": 1000,
-                    "temperature": 0.7
-                }
-            )
+            response = self._post_hedged("description", "chat", "/chat/completions", {
+                "model": "gpt-4",
+                "messages": [{"role": "user", "content": prompt}],
+                "max_tokens": 1000,
+                "temperature": 0.7
+            })
             
             if response.status_code == 200:
-                improved_text = response.json()['choices'][0]['message']['content'].strip()
-                return improved_text
+                data = response.json()
+                self._record_usage("Улучшение описания", data, estimate_tokens(prompt))
+                return data['choices'][0]['message']['content'].strip()
             else:
                 logger.error(f"Ошибка API при генерации описания: {response.status_code}")
                 return text
@@ -217,36 +449,129 @@ class ImageService:
             logger.error(f"Ошибка при генерации описания: {e}")
             return text
 
+    def prepare_prompt(self, text, style="default"):
+        """Перевод на английский и улучшение описания одним запросом к GPT-4
+        вместо двух последовательных. При ошибке возвращается исходный текст"""
+        try:
+            compiled = self.prompt_compiler.compile_style(self.get_style(style))
+            prompt = PROMPT_TEMPLATE.format(style=style, text=text, style_features=compiled.brief)
+            
+            response = self._post_hedged("prepare_prompt", "chat", "/chat/completions", {
+                "model": "gpt-4",
+                "messages": [{"role": "user", "content": prompt}],
+                "max_tokens": 400,
+                "temperature": 0.7
+            }, timeout=TRANSLATION_TIMEOUT)
+            
+            if response.status_code == 200:
+                data = response.json()
+                self._record_usage("Перевод и улучшение", data, estimate_tokens(prompt))
+                return data['choices'][0]['message']['content'].strip().strip('"')
+            else:
+                logger.error(f"Ошибка API при подготовке промпта: {response.status_code}")
+                return text
+        except Exception as e:
+            logger.error(f"Ошибка при подготовке промпта: {e}")
+            return text
+
     def translate_text(self, text, target_lang):
         """Перевод текста через OpenAI API"""
-        language_names = {
-            "en": "английский",
-            "ru": "русский",
-            "es": "испанский",
-            "fr": "французский",
-            "de": "немецкий",
-            "ja": "японский",
-            "zh": "китайский"
-        }
+        cached = self._get_cached_translation(text, target_lang)
+        if cached is not None:
+            return cached
         
         payload = {
             "model": "gpt-4",
             "messages": [{
                 "role": "user",
-                "content": f"Переведи следующий текст на {language_names.get(target_lang, target_lang)} язык: {text}"
+                "content": f"Переведи следующий текст на {LANGUAGE_NAMES.get(target_lang, target_lang)} язык: {text}"
             }]
         }
         
         try:
-            response = requests.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers=self.headers,
-                json=payload
-            )
+            response = self._post_hedged("translate", "chat", "/chat/completions", payload, timeout=TRANSLATION_TIMEOUT)
             
             if response.status_code == 200:
-                return response.json()['choices'][0]['message']['content']
+                data = response.json()
+                self._record_usage("Перевод", data, estimate_tokens(payload["messages"][0]["content"]))
+                translated = data['choices'][0]['message']['content']
+                self._cache_translation(text, target_lang, translated)
+                return translated
             else:
                 return f"Ошибка перевода: {response.status_code}"
         except Exception as e:
-            return f"Ошибка при переводе: {str(e)}" 
\ No newline at end of file
+            return f"Ошибка при переводе: {str(e)}"
+
+    def translate_batch(self, text, target_langs):
+        """Перевод текста сразу на несколько языков одним запросом"""
+        translations = {}
+        missing = []
+        for lang in target_langs:
+            cached = self._get_cached_translation(text, lang)
+            if cached is not None:
+                translations[lang] = cached
+            else:
+                missing.append(lang)
+        
+        if not missing:
+            return translations
+        
+        languages = ", ".join(f'"{lang}" ({LANGUAGE_NAMES.get(lang, lang)})' for lang in missing)
+        prompt = f"""Переведи следующий текст на языки: {languages}.
+Ответь только JSON-объектом без пояснений, где ключ - код языка, а значение - перевод.
+
+Текст: {text}"""
+        
+        try:
+            response = self._post_hedged("translate_batch", "chat", "/chat/completions", {
+                "model": "gpt-4",
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": 0
+            }, timeout=TRANSLATION_TIMEOUT)
+            response.raise_for_status()
+            data = response.json()
+            self._record_usage("Пакетный перевод", data, estimate_tokens(prompt))
+            content = data['choices'][0]['message']['content']
+            batch = self._parse_translations(content, missing)
+        except Exception as e:
+            logger.warning(f"Пакетный перевод не удался, переводим по отдельности: {e}")
+            batch = None
+        
+        if batch is None:
+            # Запасной вариант - параллельные запросы по каждому языку
+            with ThreadPoolExecutor(max_workers=len(missing)) as executor:
+                results = executor.map(lambda lang: self.translate_text(text, lang), missing)
+                batch = dict(zip(missing, results))
+        else:
+            for lang, translated in batch.items():
+                self._cache_translation(text, lang, translated)
+        
+        translations.update(batch)
+        return {lang: translations[lang] for lang in target_langs}
+
+    def _parse_translations(self, content, target_langs):
+        """Разбор JSON-ответа пакетного перевода"""
+        content = content.strip()
+        # Модель иногда оборачивает JSON в блок кода
+        if content.startswith("```"):
+            content = content.strip("`")
+            content = content[content.index("{"):] if "{" in content else content
+        try:
+            data = json.loads(content)
+        except ValueError:
+            logger.warning("Не удалось разобрать JSON пакетного перевода")
+            return None
+        if not isinstance(data, dict) or not all(isinstance(data.get(lang), str) for lang in target_langs):
+            logger.warning("В ответе пакетного перевода нет части языков")
+            return None
+        return {lang: data[lang].strip() for lang in target_langs}
+
+    def _get_cached_translation(self, text, target_lang):
+        """Получение перевода из кеша"""
+        with self.cache_lock:
+            return self.translation_cache.get((text, target_lang))
+
+    def _cache_translation(self, text, target_lang, translated):
+        """Сохранение перевода в кеш"""
+        with self.cache_lock:
+            self.translation_cache[(text, target_lang)] = translated
@@ -0,0 +1,138 @@
+import re
+import math
+import threading
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Нумерация пунктов списка в начале строки: "1. ", "2) "
+LIST_MARKER = re.compile(r'^\s*\d+[.)]\s*')
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+WORD = re.compile(r'\w+|[^\w\s]')
+
+# Сколько пунктов стиля оставлять до удаления заключительных фраз
+MIN_STYLE_ITEMS = 3
+
+def normalize_whitespace(text):
+    """Схлопывание пробелов и отступов в строках, пустые строки удаляются"""
+    lines = (" ".join(line.split()) for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+def _instruction_key(text):
+    return " ".join(re.sub(r'[^\w\s]', ' ', text.lower()).split())
+
+if tiktoken is not None:
+    _encoding = tiktoken.get_encoding("cl100k_base")
+
+    def estimate_tokens(text):
+        """Число токенов по словарю tiktoken"""
+        return len(_encoding.encode(text))
+else:
+    def estimate_tokens(text):
+        """Приближенная оценка числа токенов без сетевых запросов.
+        Латиница - около 4 символов на токен, кириллица и прочее - около 2"""
+        tokens = 0
+        for piece in WORD.findall(text):
+            if not piece[0].isalnum() and piece[0] != '_':
+                tokens += 1
+            elif piece.isascii():
+                tokens += max(1, math.ceil(len(piece) / 4))
+            else:
+                tokens += max(1, math.ceil(len(piece) / 2))
+        return tokens
+
+def truncate_words(text, limit):
+    """Обрезка по границе слова с многоточием"""
+    if len(text) <= limit:
+        return text
+    cut = text[:max(limit - 1, 0)]
+    if ' ' in cut:
+        cut = cut.rsplit(' ', 1)[0]
+    return cut.rstrip(' ,;:') + "…"
+
+class CompiledStyle:
+    """Стиль, разобранный на вводную фразу, пункты и заключительные фразы"""
+
+    __slots__ = ('prefix', 'header', 'items', 'sentences', 'suffix', 'brief', 'tokens')
+
+    def __init__(self, prefix, suffix):
+        self.prefix = normalize_whitespace(prefix).replace("\n", " ")
+        self.header = ""
+        self.items = []
+        self.sentences = []
+        seen = {_instruction_key(self.prefix)}
+
+        lines = normalize_whitespace(suffix).splitlines()
+        if lines and lines[0].endswith(':') and len(lines) > 1:
+            self.header = lines.pop(0)
+        for line in lines:
+            is_item = bool(LIST_MARKER.match(line))
+            parts = [LIST_MARKER.sub('', line)] if is_item else SENTENCE_END.split(line)
+            for part in parts:
+                part = part.strip()
+                key = _instruction_key(part)
+                # Повторы инструкций только удлиняют промпт
+                if not key or key in seen:
+                    continue
+                seen.add(key)
+                (self.items if is_item else self.sentences).append(part.rstrip(';'))
+
+        self.suffix = self.render()
+        # Для GPT достаточно перечня особенностей стиля без вводных фраз
+        self.brief = "; ".join(item.rstrip('.') for item in self.items + self.sentences)
+        self.tokens = estimate_tokens(f"{self.prefix} {self.suffix}")
+
+    def render(self, items=None, sentences=None):
+        """Текст стиля из заданного подмножества пунктов"""
+        items = self.items if items is None else items
+        sentences = self.sentences if sentences is None else sentences
+        parts = []
+        if items:
+            body = "; ".join(item.rstrip('.') for item in items) + "."
+            parts.append(f"{self.header} {body}" if self.header else body)
+        parts.extend(sentences)
+        return " ".join(parts)
+
+class PromptCompiler:
+    """Сборка промптов из заранее скомпилированных стилей с учетом лимита длины"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.compiled = {}
+
+    def compile_style(self, style_data):
+        """Стиль компилируется один раз; при изменении текста - заново"""
+        source = (style_data["prefix"], style_data["suffix"])
+        with self.lock:
+            compiled = self.compiled.get(source)
+            if compiled is None:
+                compiled = self.compiled[source] = CompiledStyle(*source)
+            return compiled
+
+    def build(self, style_data, description, limit):
+        """Промпт изображения не длиннее limit символов.
+
+        Описание пользователя важнее стиля, поэтому сначала отбрасываются
+        последние пункты стиля, затем заключительные фразы, и только потом
+        обрезается само описание. Возвращает (промпт, обрезан ли он)"""
+        compiled = self.compile_style(style_data)
+        description = " ".join(description.split()).rstrip('.')
+        head = f"{compiled.prefix} {description}."
+        prompt = f"{head} {compiled.suffix}".strip()
+        if len(prompt) <= limit:
+            return prompt, False
+
+        items = list(compiled.items)
+        sentences = list(compiled.sentences)
+        while items or sentences:
+            if len(items) > MIN_STYLE_ITEMS or (items and not sentences):
+                items.pop()
+            else:
+                sentences.pop()
+            prompt = f"{head} {compiled.render(items, sentences)}".strip()
+            if len(prompt) <= limit:
+                return prompt, True
+
+        return truncate_words(head, limit), True
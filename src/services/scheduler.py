@@ -0,0 +1,211 @@
+import time
+import threading
+import collections
+from concurrent.futures import Future
+
+# Классы приоритета: интерактивные задания всегда выбираются раньше фоновых
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+
+# Сколько последних ожиданий хранить для статистики
+WAIT_SAMPLES = 1000
+
+class OverloadedError(Exception):
+    """Очередь планировщика заполнена"""
+
+class _Job:
+    __slots__ = ('future', 'func', 'args', 'tenant', 'priority', 'enqueued')
+
+    def __init__(self, future, func, args, tenant, priority):
+        self.future = future
+        self.func = func
+        self.args = args
+        self.tenant = tenant
+        self.priority = priority
+        self.enqueued = time.monotonic()
+
+class _Tenant:
+    __slots__ = ('queues', 'running', 'queued', 'virtual_time')
+
+    def __init__(self, virtual_time):
+        self.queues = {priority: collections.deque() for priority in PRIORITIES}
+        self.running = 0
+        self.queued = 0
+        self.virtual_time = virtual_time
+
+class FairScheduler:
+    """Планировщик заданий со справедливым разделением пула между клиентами.
+
+    У каждого клиента (tenant) своя очередь на каждый класс приоритета.
+    Внутри класса выбирается клиент с наименьшим виртуальным временем
+    (взвешенная справедливая очередь): каждое запущенное задание сдвигает
+    его на 1/вес. Фоновым заданиям не отдаются последние interactive_reserve
+    исполнителей, чтобы интерактивные запросы не ждали окончания пакета."""
+
+    def __init__(self, workers, max_queued=None, tenant_limit=None, tenant_queue=None,
+                 interactive_reserve=1, name="scheduler"):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.tenant_limit = tenant_limit
+        self.tenant_queue = tenant_queue
+        self.batch_limit = max(1, workers - interactive_reserve)
+        self.condition = threading.Condition()
+        self.tenants = {}
+        self.weights = {}
+        self.virtual_time = 0.0
+        self.running = {priority: 0 for priority in PRIORITIES}
+        self.queued = 0
+        self.rejected = 0
+        self.completed = 0
+        self.waits = {priority: collections.deque(maxlen=WAIT_SAMPLES) for priority in PRIORITIES}
+        self.paused_until = {priority: 0.0 for priority in PRIORITIES}
+        self.closed = False
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"{name}_{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def set_weight(self, tenant, weight):
+        """Вес клиента: доля пула пропорциональна весу"""
+        with self.condition:
+            self.weights[tenant] = weight
+
+    def pause(self, priority, seconds):
+        """Задержка выдачи заданий класса; новые задания копятся в очереди.
+        seconds=0 снимает задержку"""
+        with self.condition:
+            self.paused_until[priority] = time.monotonic() + seconds if seconds > 0 else 0.0
+            self.condition.notify_all()
+
+    def _pause_remaining(self):
+        """Сколько ждать до снятия ближайшей задержки; None - задержек нет"""
+        now = time.monotonic()
+        remaining = [until - now for until in self.paused_until.values() if until > now]
+        return min(remaining) if remaining else None
+
+    def submit(self, func, *args, tenant="local", priority=INTERACTIVE):
+        """Постановка задания в очередь клиента. При переполнении - OverloadedError"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Неизвестный приоритет: {priority}")
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Планировщик остановлен")
+            state = self.tenants.get(tenant)
+            in_system = self.queued + sum(self.running.values())
+            if (self.max_queued is not None and in_system >= self.workers + self.max_queued) or \
+                    (self.tenant_queue is not None and state is not None and state.queued >= self.tenant_queue):
+                self.rejected += 1
+                raise OverloadedError()
+            if state is None:
+                # Вернувшийся клиент не получает преимущества за время простоя
+                state = self.tenants[tenant] = _Tenant(self.virtual_time)
+            state.queues[priority].append(_Job(future, func, args, tenant, priority))
+            state.queued += 1
+            self.queued += 1
+            self.condition.notify()
+        return future
+
+    def _next_job(self):
+        """Выбор следующего задания (вызывается под блокировкой)"""
+        now = time.monotonic()
+        for priority in PRIORITIES:
+            if priority == BATCH and self.running[BATCH] >= self.batch_limit:
+                continue
+            if now < self.paused_until[priority]:
+                continue
+            best = None
+            for state in self.tenants.values():
+                if not state.queues[priority]:
+                    continue
+                if self.tenant_limit is not None and state.running >= self.tenant_limit:
+                    continue
+                if best is None or state.virtual_time < best.virtual_time:
+                    best = state
+            if best is None:
+                continue
+            job = best.queues[priority].popleft()
+            self.virtual_time = max(self.virtual_time, best.virtual_time)
+            best.virtual_time += 1.0 / self.weights.get(job.tenant, 1.0)
+            best.queued -= 1
+            best.running += 1
+            self.queued -= 1
+            self.running[priority] += 1
+            self.waits[priority].append(time.monotonic() - job.enqueued)
+            return job
+        return None
+
+    def _finish(self, job):
+        with self.condition:
+            state = self.tenants[job.tenant]
+            state.running -= 1
+            self.running[job.priority] -= 1
+            self.completed += 1
+            if not state.running and not state.queued:
+                del self.tenants[job.tenant]
+            # Освободилось место клиента или фонового класса - будим всех
+            self.condition.notify_all()
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                job = self._next_job()
+                while job is None:
+                    if self.closed:
+                        return
+                    self.condition.wait(self._pause_remaining())
+                    job = self._next_job()
+            if not job.future.set_running_or_notify_cancel():
+                self._finish(job)
+                continue
+            try:
+                result = job.func(*job.args)
+            except BaseException as e:
+                # Место освобождается до завершения Future, чтобы ожидающий
+                # результата мог сразу поставить следующее задание
+                self._finish(job)
+                job.future.set_exception(e)
+            else:
+                self._finish(job)
+                job.future.set_result(result)
+
+    def stats(self):
+        """Состояние очередей и статистика ожидания по классам приоритета"""
+        with self.condition:
+            waits = {}
+            for priority, samples in self.waits.items():
+                ordered = sorted(samples)
+                waits[priority] = {
+                    'count': len(ordered),
+                    'p50': round(ordered[len(ordered) // 2], 4) if ordered else 0,
+                    'p95': round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 4) if ordered else 0,
+                    'max': round(ordered[-1], 4) if ordered else 0
+                }
+            return {
+                'workers': self.workers,
+                'queued': self.queued,
+                'running': dict(self.running),
+                'tenants': len(self.tenants),
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'paused': [priority for priority, until in self.paused_until.items() if until > time.monotonic()],
+                'queue_wait': waits
+            }
+
+    def shutdown(self, wait=False):
+        """Остановка исполнителей; задания в очереди отменяются"""
+        with self.condition:
+            self.closed = True
+            for state in self.tenants.values():
+                for queue in state.queues.values():
+                    for job in queue:
+                        job.future.cancel()
+                    queue.clear()
+                self.queued -= state.queued
+                state.queued = 0
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
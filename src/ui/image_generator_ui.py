@@ -1,10 +1,17 @@
+import os
 import tkinter as tk
-from tkinter import ttk, messagebox
-from PIL import Image, ImageTk
-import threading
+from tkinter import ttk, messagebox, filedialog
+from PIL import ImageTk
 from ..services.image_service import ImageService
+from ..services.scheduler import FairScheduler, BATCH
+from ..services.circuit_breaker import CircuitOpenError
 from ..utils.image_storage import ImageStorage
-from ..utils.config import UI_CONFIG
+from ..utils.image_pyramid import ImagePyramid
+from ..utils.image_residency import ImageResidency
+from ..utils.library_scanner import LibraryScanner
+from ..utils.profiler import profiler
+from ..utils.retention import RetentionManager
+from ..utils.config import UI_CONFIG, TRANSLATION_TIMEOUT
 
 class LoadingIndicator:
     def __init__(self, parent):
@@ -65,8 +72,43 @@ class ImageGeneratorUI:
         self.image_storage = ImageStorage()
         self.loading_indicator = LoadingIndicator(self.root)
 
+        # Горячие пути профилируются, когда включен режим профилирования
+        profiler.wrap_methods(
+            self, 'generate_new', 'generate_draft', 'show_history_item', 'render_current_image'
+        )
+        profiler.wrap_methods(self.image_storage, 'save_image', 'load_preview')
+        profiler.wrap_methods(self.image_service, 'generate_image_with_info', 'prepare_prompt')
+
+        # Фоновое соблюдение дисковой квоты
+        self.retention = RetentionManager(self.image_storage)
+        self.retention.start()
+
+        # Общий пул рабочих потоков: фоновые задания не занимают последний поток,
+        # поэтому генерация не ждет окончания экспорта или индексации
+        self.scheduler = FairScheduler(workers=4, name="neyrotg")
+        
+        # Хеши и признаки для старых изображений считаем в фоне
+        self.scheduler.submit(self.image_storage.backfill_indexes, priority=BATCH)
+
         # История генераций
         self.current_history_index = -1
+
+        # Номер текущей генерации и последней показанной финальной картинки
+        self.generation_id = 0
+        self.shown_generation_id = 0
+
+        # Учет изображений в памяти: панель закреплена, окна увеличения вытесняются
+        self.residency = ImageResidency(UI_CONFIG['image_pixel_budget'])
+        self.enlarged_count = 0
+
+        # Пирамида текущего изображения для перерисовки при изменении размера
+        self.current_pyramid = None
+        self.current_image_path = None
+        self.rendered_size = None
+        # Превью под увеличенное окно: загружаемый файл и файл, загруженный целиком
+        self.preview_request = None
+        self.full_resolution_path = None
+        self.resize_job = None
         
         # Настраиваем UI
         self.setup_ui()
@@ -79,6 +121,30 @@ class ImageGeneratorUI:
         
         # Ждем полной инициализации окна перед загрузкой истории
         self.root.after(500, self.delayed_load_history)
+        
+        # Отслеживаем записи, добавленные другими процессами
+        self.root.after(2000, self.poll_history_changes)
+        
+        # Свернутое окно не держит отрисованное изображение
+        self.root.bind('<Unmap>', self.on_root_unmap, add='+')
+        self.root.bind('<Map>', self.on_root_map, add='+')
+        
+        # F12 - включение и выключение профилирования
+        self.root.bind('<F12>', self.toggle_profiling)
+
+    def poll_history_changes(self):
+        """Периодическая проверка истории на изменения из других процессов"""
+        try:
+            if self.image_storage.refresh_if_changed():
+                history = self.image_storage.get_history()
+                if history and self.current_history_index < 0:
+                    self.current_history_index = len(history) - 1
+                    self.show_history_item(self.current_history_index)
+                else:
+                    self.update_navigation_buttons()
+        except Exception as e:
+            print(f"Ошибка при обновлении истории: {e}")
+        self.root.after(2000, self.poll_history_changes)
 
     def delayed_load_history(self):
         """Отложенная загрузка истории после инициализации окна"""
@@ -211,10 +277,134 @@ class ImageGeneratorUI:
         
         # Добавляем обработчик клика для увеличения
         self.image_label.bind('<Button-1>', self.show_enlarged_image)
+        
+        # Перерисовка изображения при изменении размера окна
+        self.image_frame.bind('<Configure>', self.on_image_frame_configure)
+
+    def on_image_frame_configure(self, event=None):
+        """Отложенная перерисовка изображения после изменения размера"""
+        if self.current_pyramid is None:
+            return
+        if self.resize_job:
+            self.root.after_cancel(self.resize_job)
+        self.resize_job = self.root.after(150, self.render_current_image)
+
+    def get_frame_size(self):
+        """Доступный размер для изображения внутри фрейма"""
+        frame_width = self.image_frame.winfo_width() - 20
+        frame_height = self.image_frame.winfo_height() - 20
+        
+        if frame_width <= 1 or frame_height <= 1:
+            frame_width = 500
+            frame_height = 500
+        return frame_width, frame_height
+
+    def render_current_image(self):
+        """Отрисовка текущего изображения под размер фрейма"""
+        self.resize_job = None
+        if self.current_pyramid is None:
+            return
+        frame_size = self.get_frame_size()
+        if frame_size == self.rendered_size:
+            return
+        
+        # Окно стало больше загруженного превью - декодируем файл заново в фоне,
+        # а пока показываем растянутый текущий уровень
+        pyramid_width, pyramid_height = self.current_pyramid.size
+        if self.current_image_path and self.current_image_path != self.full_resolution_path \
+                and self.preview_request is None \
+                and min(frame_size[0]/pyramid_width, frame_size[1]/pyramid_height) > 1:
+            self.preview_request = self.current_image_path
+            self.scheduler.submit(self.load_larger_preview, self.current_image_path, frame_size)
+        
+        fitted = self.current_pyramid.fit(*frame_size)
+        photo = ImageTk.PhotoImage(fitted)
+        # Промежуточная копия нужна только для создания PhotoImage
+        if all(fitted is not level for level in self.current_pyramid.levels):
+            fitted.close()
+        self.residency.release("main_photo")
+        self.image_label.configure(image=photo)
+        self.image_label.image = photo  # Сохраняем ссылку!
+        self.residency.track("main_photo", photo, on_release=self.clear_image_label, pinned=True)
+        self.rendered_size = frame_size
+
+    def load_larger_preview(self, image_path, frame_size):
+        """Декодирование превью под увеличенное окно в рабочем потоке"""
+        pyramid = None
+        try:
+            image = self.image_storage.load_preview(image_path, frame_size)
+            if image:
+                pyramid = ImagePyramid(image)
+        except Exception as e:
+            print(f"Ошибка при загрузке превью: {e}")
+
+        def swap():
+            self.preview_request = None
+            current = self.current_pyramid
+            if pyramid is None or image_path != self.current_image_path or current is None:
+                if pyramid is not None:
+                    for level in pyramid.levels:
+                        level.close()
+                # Пока грузилось превью, показали другое изображение - проверяем его размер
+                if current is not None and image_path != self.current_image_path:
+                    self.rendered_size = None
+                    self.render_current_image()
+                return
+            if pyramid.size[0] > current.size[0]:
+                self.set_current_pyramid(pyramid)
+                self.rendered_size = None
+                self.render_current_image()
+            else:
+                # Файл не больше уже загруженного - повторно не декодируем
+                self.full_resolution_path = image_path
+                for level in pyramid.levels:
+                    level.close()
+
+        self.root.after(0, swap)
+
+    def clear_image_label(self):
+        """Снятие изображения с панели, чтобы Tk освободил его память"""
+        self.image_label.configure(image='')
+        self.image_label.image = None
+        self.rendered_size = None
+
+    def set_current_pyramid(self, pyramid):
+        """Замена пирамиды текущего изображения с освобождением предыдущей"""
+        self.residency.release("main")
+        self.current_pyramid = pyramid
+        for level in pyramid.levels:
+            self.residency.track("main", level, pinned=True)
+
+    def toggle_profiling(self, event=None):
+        """Переключение режима профилирования с записью профилей сеанса"""
+        if profiler.enabled:
+            report_path = profiler.stop()
+            text = f"⏱ Профили сохранены: {os.path.dirname(report_path)}" if report_path else "⏱ Профилирование выключено"
+        else:
+            profiler.start()
+            text = "⏱ Профилирование включено (F12 - остановить)"
+        self.status_label.config(text=text)
+
+    def on_root_unmap(self, event):
+        if event.widget is self.root:
+            self.residency.release("main_photo")
+
+    def on_root_map(self, event):
+        if event.widget is self.root and self.current_pyramid is not None and self.rendered_size is None:
+            self.render_current_image()
+
+    def display_image(self, image, pyramid=None, source_path=None):
+        """Показ изображения в панели"""
+        self.current_image_path = source_path  # Файл для увеличения и перерисовки
+        self.full_resolution_path = None
+        self.set_current_pyramid(pyramid or ImagePyramid(image))
+        self.rendered_size = None
+        self.no_image_label.place_forget()
+        self.render_current_image()
 
     def show_enlarged_image(self, event=None):
         """Показать увеличенное изображение"""
-        if hasattr(self, 'current_image'):
+        if self.current_pyramid is not None:
             top = tk.Toplevel(self.root)
             top.title("Увеличенное изображение")
             
@@ -227,21 +417,34 @@ class ImageGeneratorUI:
             max_height = int(screen_height * 0.8)
             
             # Изменяем размер изображения, сохраняя пропорции
-            img_width, img_height = self.current_image.size
-            ratio = min(max_width/img_width, max_height/img_height)
-            new_width = int(img_width * ratio)
-            new_height = int(img_height * ratio)
-            
-            resized_image = self.current_image.resize(
-                (new_width, new_height),
-                Image.Resampling.LANCZOS
-            )
+            pyramid = self.current_pyramid
+            image = None
+            if self.current_image_path:
+                image = self.image_storage.load_preview(self.current_image_path, (max_width, max_height))
+                if image:
+                    pyramid = ImagePyramid(image)
+            resized_image = pyramid.fit(max_width, max_height)
+            new_width, new_height = resized_image.size
             photo = ImageTk.PhotoImage(resized_image)
             
+            # В окне остается только PhotoImage, декодированные копии закрываем сразу
+            if pyramid is not self.current_pyramid:
+                image.close()
+                for level in pyramid.levels:
+                    level.close()
+            if all(resized_image is not level for level in self.current_pyramid.levels):
+                resized_image.close()
+            
             label = ttk.Label(top, image=photo)
             label.image = photo
             label.pack()
             
+            # Окно закрывается и при вытеснении из памяти
+            self.enlarged_count += 1
+            owner = f"enlarged_{self.enlarged_count}"
+            self.residency.track(owner, photo, on_release=lambda: top.winfo_exists() and top.destroy())
+            top.protocol("WM_DELETE_WINDOW", lambda: self.residency.release(owner))
+            
             # Центрируем окно
             x = (screen_width - new_width) // 2
             y = (screen_height - new_height) // 2
@@ -251,7 +454,7 @@ class ImageGeneratorUI:
             close_btn = ttk.Button(
                 top,
                 text="Закрыть",
-                command=top.destroy
+                command=lambda: self.residency.release(owner)
             )
             close_btn.pack(pady=10)
 
@@ -303,6 +506,12 @@ class ImageGeneratorUI:
             foreground=UI_CONFIG['text_color'],
             font=('Helvetica', 12))
             
+        # Флажки
+        style.configure('TCheckbutton',
+            background=UI_CONFIG['bg_color'],
+            foreground=UI_CONFIG['text_color'],
+            font=('Helvetica', 12))
+            
         # Прогрессбар
         style.configure('TProgressbar',
             background=UI_CONFIG['accent_color'],
@@ -464,6 +673,37 @@ class ImageGeneratorUI:
         )
         self.generate_button.pack(fill=tk.X, pady=(5, 0))
 
+        # Перевод, улучшение и генерация без промежуточных шагов
+        self.quick_generate_button = ttk.Button(
+            self.control_buttons_frame,
+            text="🚀 Улучшить и создать",
+            command=lambda: self.start_generation_thread(enhance=True)
+        )
+        self.quick_generate_button.pack(fill=tk.X, pady=(5, 0))
+
+        # Повторное использование ранее созданных изображений
+        self.reuse_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            self.control_buttons_frame,
+            text="♻️ Использовать сохранённые",
+            variable=self.reuse_var
+        ).pack(anchor=tk.W, pady=(5, 0))
+
+        # Прогрессивный предпросмотр: быстрый черновик до финального изображения
+        self.draft_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(
+            self.control_buttons_frame,
+            text="⚡ Быстрый черновик",
+            variable=self.draft_var
+        ).pack(anchor=tk.W, pady=(5, 0))
+
+        self.force_new_button = ttk.Button(
+            self.control_buttons_frame,
+            text="🔄 Создать заново",
+            command=lambda: self.start_generation_thread(force_new=True)
+        )
+        self.force_new_button.pack(fill=tk.X, pady=(5, 0))
+
         # Статус генерации
         self.status_label = ttk.Label(
             self.control_buttons_frame,
@@ -499,6 +739,14 @@ class ImageGeneratorUI:
         )
         self.history_button.pack(fill=tk.X, pady=5)
 
+        # Поиск почти одинаковых изображений
+        self.similar_button = ttk.Button(
+            self.control_buttons_frame,
+            text="🔍 Похожие",
+            command=self.show_similar
+        )
+        self.similar_button.pack(fill=tk.X, pady=5)
+
     def generate_description(self):
         """Улучшение текущего описания"""
         current_text = self.description_text.get(1.0, tk.END).strip()
@@ -520,16 +768,13 @@ class ImageGeneratorUI:
             
             self.root.after(0, update_ui)
         
-        # Запускаем в отдельном потоке
-        thread = threading.Thread(target=process_description)
-        thread.daemon = True
-        thread.start()
+        self.scheduler.submit(process_description)
 
     def show_translation_dialog(self):
         """Показать диалог выбора языка для перевода"""
         dialog = tk.Toplevel(self.root)
         dialog.title("Выберите язык")
-        dialog.geometry("200x250")
+        dialog.geometry("240x400")
         dialog.transient(self.root)
         dialog.grab_set()
 
@@ -543,27 +788,143 @@ class ImageGeneratorUI:
             ("中文", "zh")
         ]
 
-        def translate(lang_code):
+        buttons = []
+        # Текущее задание перевода; None - перевод не выполняется
+        state = {'job': None, 'timeout_job': None}
+
+        progress = ttk.Progressbar(dialog, mode='indeterminate', length=180)
+        status = ttk.Label(dialog, text="", font=('Helvetica', 10), justify=tk.CENTER)
+
+        def set_busy(busy):
+            for button in buttons:
+                button.config(state='disabled' if busy else 'normal')
+            if busy:
+                progress.pack(fill=tk.X, padx=10, pady=(5, 0))
+                progress.start(10)
+            else:
+                progress.stop()
+                progress.pack_forget()
+
+        def stop_job():
+            state['job'] = None
+            if state['timeout_job']:
+                self.root.after_cancel(state['timeout_job'])
+                state['timeout_job'] = None
+
+        def run_translation(task, on_result):
             text = self.description_text.get(1.0, tk.END).strip()
-            if text:
-                translated = self.image_service.translate_text(text, lang_code)
-                self.description_text.delete(1.0, tk.END)
-                self.description_text.insert(1.0, translated)
+            if not text:
+                dialog.destroy()
+                return
+            
+            job = object()
+            state['job'] = job
+            set_busy(True)
+            status.config(text="Перевод...")
+            
+            future = self.scheduler.submit(task, text)
+            
+            def on_timeout():
+                state['timeout_job'] = None
+                if state['job'] is not job:
+                    return
+                stop_job()
+                future.cancel()
+                set_busy(False)
+                status.config(text="⏱ Превышено время ожидания")
+            
+            state['timeout_job'] = self.root.after(TRANSLATION_TIMEOUT * 1000, on_timeout)
+            
+            def apply_result(done_future):
+                # Результат отменённого или просроченного задания игнорируется
+                if state['job'] is not job:
+                    return
+                stop_job()
+                try:
+                    result = done_future.result()
+                except Exception as e:
+                    set_busy(False)
+                    status.config(text=f"❌ Ошибка: {e}")
+                    return
+                dialog.destroy()
+                on_result(result)
+            
+            future.add_done_callback(lambda f: self.root.after(0, lambda: apply_result(f)))
+
+        def apply_translation(translated):
+            self.description_text.delete(1.0, tk.END)
+            self.description_text.insert(1.0, translated)
+
+        def translate(lang_code):
+            run_translation(
+                lambda text: self.image_service.translate_text(text, lang_code),
+                apply_translation
+            )
+
+        def translate_all():
+            codes = [code for _, code in languages]
+            run_translation(
+                lambda text: self.image_service.translate_batch(text, codes),
+                lambda translations: self.show_translations_window(translations, languages)
+            )
+
+        def cancel():
+            stop_job()
             dialog.destroy()
 
         for lang_name, lang_code in languages:
-            ttk.Button(
+            button = ttk.Button(
                 dialog,
                 text=lang_name,
                 command=lambda code=lang_code: translate(code)
-            ).pack(fill=tk.X, padx=10, pady=2)
+            )
+            button.pack(fill=tk.X, padx=10, pady=2)
+            buttons.append(button)
+
+        button = ttk.Button(
+            dialog,
+            text="🌐 Все языки",
+            command=translate_all
+        )
+        button.pack(fill=tk.X, padx=10, pady=(10, 2))
+        buttons.append(button)
 
         ttk.Button(
             dialog,
             text="Отмена",
-            command=dialog.destroy
+            command=cancel
         ).pack(fill=tk.X, padx=10, pady=10)
 
+        status.pack(fill=tk.X, padx=10)
+        dialog.protocol("WM_DELETE_WINDOW", cancel)
+
+    def show_translations_window(self, translations, languages):
+        """Показать переводы на все выбранные языки"""
+        window = tk.Toplevel(self.root)
+        window.title("Переводы")
+        window.geometry("600x500")
+        window.configure(bg=UI_CONFIG['bg_color'])
+
+        text_widget = tk.Text(
+            window,
+            wrap=tk.WORD,
+            bg=UI_CONFIG['secondary_bg'],
+            fg=UI_CONFIG['text_color'],
+            insertbackground=UI_CONFIG['text_color'],
+            font=('Helvetica', 12),
+            padx=10,
+            pady=10
+        )
+        text_widget.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        for lang_name, lang_code in languages:
+            if lang_code in translations:
+                text_widget.insert(tk.END, f"{lang_name}:\n{translations[lang_code]}\n\n")
+
+        text_widget.bind('<Control-c>', lambda e: self.copy_text(text_widget))
+        text_widget.bind('<Control-a>', lambda e: self.select_all(text_widget))
+        text_widget.bind('<Button-3>', lambda e: self.show_context_menu(e, text_widget))
+
     def setup_bottom_panel(self):
         """Настройка нижней панели"""
         self.bottom_frame = ttk.Frame(self.main_container)
@@ -572,17 +933,74 @@ class ImageGeneratorUI:
         # Добавляем пустое пространство для отступа
         ttk.Frame(self.bottom_frame).pack(fill=tk.X, expand=True)
 
-    def start_generation_thread(self):
+        # Индикатор доступности API
+        self.health_label = ttk.Label(self.bottom_frame, text="", font=('Helvetica', 10))
+        self.health_label.pack(side=tk.RIGHT)
+        self.update_health_indicator()
+
+        # Память, занятая изображениями
+        self.memory_label = ttk.Label(self.bottom_frame, text="", font=('Helvetica', 10))
+        self.memory_label.pack(side=tk.LEFT)
+        self.update_memory_indicator()
+
+    def update_memory_indicator(self):
+        """Обновление индикатора памяти изображений"""
+        usage = self.residency.usage()
+        self.memory_label.config(
+            text=f"🖼 {usage['pixels'] / 1e6:.1f} Мпикс (~{usage['bytes_estimate'] / 2**20:.0f} МБ)"
+        )
+        self.root.after(2000, self.update_memory_indicator)
+
+    def update_health_indicator(self):
+        """Обновление индикатора состояния точек доступа API"""
+        marks = {'closed': "🟢", 'half_open': "🟡", 'open': "🔴"}
+        names = {'images': "изображения", 'chat': "текст"}
+        parts = []
+        for endpoint, health in self.image_service.health().items():
+            part = f"{marks.get(health['state'], '⚪')} {names.get(endpoint, endpoint)}"
+            if health['retry_after']:
+                part += f" ({health['retry_after']:.0f} с)"
+            parts.append(part)
+        self.health_label.config(text="API: " + "   ".join(parts))
+        self.root.after(1000, self.update_health_indicator)
+
+    def set_generation_buttons(self, enabled):
+        """Блокировка всех кнопок генерации, чтобы повторные нажатия не запускали платные запросы"""
+        for button in (self.generate_button, self.quick_generate_button, self.force_new_button):
+            button.config(state='normal' if enabled else 'disabled')
+
+    def start_generation_thread(self, force_new=False, enhance=False):
         """Запуск генерации в отдельном потоке"""
-        self.generate_button.config(state='disabled')
+        self.set_generation_buttons(False)
         self.loading_indicator.start(self.root)
-        self.status_label.config(text="Генерация изображения...")
+        self.status_label.config(text="Подготовка описания..." if enhance else "Генерация изображения...")
         
-        thread = threading.Thread(target=self.generate_new)
-        thread.daemon = True
-        thread.start()
+        self.generation_id += 1
+        self.scheduler.submit(self.generate_new, force_new, self.generation_id, enhance)
 
-    def generate_new(self):
+    def generate_draft(self, description, style, generation_id):
+        """Генерация и показ черновика, пока создается финальное изображение"""
+        try:
+            draft_url = self.image_service.generate_draft(description, style)
+            if not draft_url:
+                return
+            draft = self.image_storage.download_image(draft_url)
+            draft_pyramid = ImagePyramid(draft)
+        except Exception as e:
+            print(f"Ошибка при создании черновика: {e}")
+            return
+        
+        def update_ui():
+            # Финальное изображение уже показано - черновик не нужен
+            if self.shown_generation_id >= generation_id:
+                return
+            self.display_image(draft, draft_pyramid)
+            self.loading_indicator.stop()
+            self.status_label.config(text="⚡ Черновик готов, создаём финальное изображение...")
+        
+        self.root.after(0, update_ui)
+
+    def generate_new(self, force_new=False, generation_id=0, enhance=False):
         """Генерация нового изображения"""
         try:
             description = self.description_text.get(1.0, tk.END).strip()
@@ -590,7 +1008,7 @@ class ImageGeneratorUI:
             if not description:
                 def show_error():
                     self.status_label.config(text="Введите описание изображения")
-                    self.generate_button.config(state='normal')
+                    self.set_generation_buttons(True)
                     self.loading_indicator.stop()
                     messagebox.showwarning("Внимание", "Введите описание изображения")
                 self.root.after(0, show_error)
@@ -600,36 +1018,65 @@ class ImageGeneratorUI:
             style = self.style_var.get()
             format = self.format_var.get()
 
+            # API недоступно - сообщаем сразу, не дожидаясь таймаута
+            retry_after = self.image_service.retry_after("images")
+            if retry_after:
+                raise CircuitOpenError("images", retry_after)
+
+            # Перевод и улучшение одним запросом, генерация стартует сразу после него
+            if enhance:
+                description = self.image_service.prepare_prompt(description, style)
+                
+                def show_prompt(text=description):
+                    self.description_text.delete(1.0, tk.END)
+                    self.description_text.insert(1.0, text)
+                    self.status_label.config(text="Генерация изображения...")
+                
+                self.root.after(0, show_prompt)
+
+            # Поиск уже созданного изображения с теми же параметрами
+            cache_key = self.image_service.make_cache_key(description, style, format)
+            if self.reuse_var.get() and not force_new:
+                cached_index = self.image_storage.find_cached(cache_key)
+                if cached_index is not None:
+                    def show_cached():
+                        self.current_history_index = cached_index
+                        self.show_history_item(cached_index)
+                        self.loading_indicator.stop()
+                        self.set_generation_buttons(True)
+                        self.status_label.config(text="♻️ Использовано сохранённое изображение")
+                        self.root.after(3000, lambda: self.status_label.config(text=""))
+                    
+                    self.root.after(0, show_cached)
+                    return
+
+            # Черновик генерируется параллельно с финальным изображением
+            if self.draft_var.get():
+                self.scheduler.submit(self.generate_draft, description, style, generation_id)
+
             # Генерация изображения
-            image_url = self.image_service.generate_image(description, style)
+            image_url, generation_info = self.image_service.generate_image_with_info(description, style)
             
             if image_url:
                 # Сохранение изображения
-                image_path = self.image_storage.save_image(image_url, description, format)
+                image_path = self.image_storage.save_image(
+                    image_url, description, format, cache_key, generation_info)
                 if image_path:
-                    self.current_image = Image.open(image_path)
-                    image = self.current_image.copy()
-                    
-                    # Подгоняем размер изображения под размер фрейма
-                    frame_width = self.image_frame.winfo_width() - 20
-                    frame_height = self.image_frame.winfo_height() - 20
-                    
-                    # Сохраняем пропорции
-                    img_width, img_height = image.size
-                    ratio = min(frame_width/img_width, frame_height/img_height)
-                    new_width = int(img_width * ratio)
-                    new_height = int(img_height * ratio)
+                    self.retention.trigger()
+                    image_name = os.path.basename(image_path)
+                    image = self.image_storage.load_preview(image_name, self.get_frame_size())
                     
-                    image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                    photo = ImageTk.PhotoImage(image)
+                    # Уровни пирамиды строим в рабочем потоке
+                    pyramid = ImagePyramid(image)
                     
                     def update_ui():
-                        self.current_history_index = len(self.image_storage.get_history()) - 1
-                        self.no_image_label.place_forget()
-                        self.image_label.configure(image=photo)
-                        self.image_label.image = photo
+                        self.shown_generation_id = max(self.shown_generation_id, generation_id)
+                        # Синхронизация могла дописать чужие записи после новой
+                        self.current_history_index = self.image_storage.key_index.get(
+                            os.path.splitext(image_name)[0], len(self.image_storage.get_history()) - 1)
+                        self.display_image(image, pyramid, image_name)
                         self.loading_indicator.stop()
-                        self.generate_button.config(state='normal')
+                        self.set_generation_buttons(True)
                         self.status_label.config(text="✅ Изображение создано!")
                         self.update_navigation_buttons()
                         # Очищаем статус через 3 секунды
@@ -638,8 +1085,9 @@ class ImageGeneratorUI:
                     self.root.after(0, update_ui)
             else:
                 def show_error():
+                    self.shown_generation_id = max(self.shown_generation_id, generation_id)
                     self.status_label.config(text="❌ Ошибка при генерации")
-                    self.generate_button.config(state='normal')
+                    self.set_generation_buttons(True)
                     self.loading_indicator.stop()
                     messagebox.showerror(
                         "Ошибка",
@@ -652,10 +1100,19 @@ class ImageGeneratorUI:
                     )
                 
                 self.root.after(0, show_error)
+        except CircuitOpenError as e:
+            # Выключатель разомкнут или занят пробным вызовом
+            def show_unavailable(retry_after=max(e.retry_after, 1)):
+                self.shown_generation_id = max(self.shown_generation_id, generation_id)
+                self.set_generation_buttons(True)
+                self.loading_indicator.stop()
+                self.status_label.config(text=f"🔴 API недоступно, повторите через {retry_after:.0f} с")
+            self.root.after(0, show_unavailable)
         except Exception as e:
             def show_error():
+                self.shown_generation_id = max(self.shown_generation_id, generation_id)
                 self.status_label.config(text="❌ Неизвестная ошибка")
-                self.generate_button.config(state='normal')
+                self.set_generation_buttons(True)
                 self.loading_indicator.stop()
                 messagebox.showerror("Ошибка", f"Произошла ошибка: {str(e)}")
             
@@ -682,35 +1139,33 @@ class ImageGeneratorUI:
             return
             
         item = history[index]
-        image = self.image_storage.load_image(item['image_path'])
+        
+        # Получаем размеры фрейма
+        self.image_frame.update_idletasks()
+        image = self.image_storage.load_preview(item['image_path'], self.get_frame_size())
         if not image:
-            messagebox.showerror("Ошибка", "Не удалось загрузить изображение")
+            # Файл удален или поврежден: показываем описание и не мешаем листать историю
+            self.residency.release("main")
+            self.current_pyramid = None
+            self.clear_image_label()
+            self.no_image_label.place(relx=0.5, rely=0.5, anchor=tk.CENTER)
+            self.status_label.config(text="⚠ Файл изображения не найден или поврежден - запустите проверку библиотеки")
+            self.description_text.delete(1.0, tk.END)
+            self.description_text.insert(1.0, item['description'])
+            self.update_navigation_buttons()
             return
             
         try:
-            self.current_image = image  # Сохраняем оригинал для увеличения
-            
-            # Получаем размеры фрейма
-            self.image_frame.update_idletasks()
-            frame_width = self.image_frame.winfo_width() - 20
-            frame_height = self.image_frame.winfo_height() - 20
+            self.display_image(image, source_path=item['image_path'])
             
-            if frame_width <= 1 or frame_height <= 1:
-                frame_width = 500
-                frame_height = 500
-            
-            # Сохраняем пропорции
-            img_width, img_height = image.size
-            ratio = min(frame_width/img_width, frame_height/img_height)
-            new_width = max(int(img_width * ratio), 1)
-            new_height = max(int(img_height * ratio), 1)
-            
-            resized_image = image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-            photo = ImageTk.PhotoImage(resized_image)
-            
-            self.no_image_label.place_forget()
-            self.image_label.configure(image=photo)
-            self.image_label.image = photo  # Сохраняем ссылку!
+            # Сообщаем, если оригинал был пережат или удален по квоте
+            tier = item.get('tier')
+            if tier == 'compact':
+                self.status_label.config(text="🗜 Показана сжатая копия")
+            elif tier == 'evicted':
+                self.status_label.config(text="🗜 Оригинал удален по квоте, показана миниатюра")
+            else:
+                self.status_label.config(text="")
             
             self.description_text.delete(1.0, tk.END)
             self.description_text.insert(1.0, item['description'])
@@ -735,24 +1190,282 @@ class ImageGeneratorUI:
         history_window.geometry("600x400")
         history_window.configure(bg=UI_CONFIG['bg_color'])
 
+        # Несколько строк можно выделить для экспорта; открытие - двойным щелчком
         history_list = tk.Listbox(history_window,
                                  font=('Helvetica', 12),
                                  bg="#2E2E2E",
-                                 fg="white")
+                                 fg="white",
+                                 selectmode=tk.EXTENDED)
         history_list.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
-        for i, item in enumerate(self.image_storage.get_history()):
-            history_list.insert(tk.END,
-                              f"{i+1}. {item['timestamp']} - {item['description'][:50]}...")
+        # Индексы истории для строк списка
+        displayed = []
 
-        def on_select(event):
+        def fill_list(rows):
+            history = self.image_storage.get_history()
+            history_list.delete(0, tk.END)
+            displayed.clear()
+            for i, label in rows:
+                item = history[i]
+                history_list.insert(tk.END,
+                                  f"{i+1}. {label}{item['timestamp']} - {item['description'][:50]}...")
+                displayed.append(i)
+
+        fill_list((i, "") for i in range(len(self.image_storage.get_history())))
+
+        def on_open(event):
             if history_list.curselection():
-                index = history_list.curselection()[0]
+                index = displayed[history_list.curselection()[0]]
                 self.current_history_index = index
                 self.show_history_item(index)
                 history_window.destroy()
 
-        history_list.bind('<<ListboxSelect>>', on_select)
+        history_list.bind('<Double-Button-1>', on_open)
+        history_list.bind('<Return>', on_open)
+
+        def show_visually_similar():
+            history = self.image_storage.get_history()
+            if not (0 <= self.current_history_index < len(history)):
+                return
+            index = self.current_history_index
+
+            def process_search():
+                try:
+                    results = self.image_storage.find_visually_similar(index)
+                except Exception as e:
+                    print(f"Ошибка поиска похожих: {e}")
+                    results = []
+                rows = [(i, f"[{score:.2f}] ") for i, score in results]
+                self.root.after(0, lambda: history_window.winfo_exists() and fill_list(rows))
+
+            self.scheduler.submit(process_search)
+
+        buttons_frame = ttk.Frame(history_window)
+        buttons_frame.pack(fill=tk.X, padx=10, pady=(0, 5))
+
+        ttk.Button(
+            buttons_frame,
+            text="🎨 Похожие по виду",
+            command=show_visually_similar
+        ).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 2))
+
+        ttk.Button(
+            buttons_frame,
+            text="📜 Все",
+            command=lambda: fill_list((i, "") for i in range(len(self.image_storage.get_history())))
+        ).pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(2, 0))
+
+        ttk.Button(
+            history_window,
+            text="📦 Экспорт",
+            command=lambda: self.export_history([displayed[i] for i in history_list.curselection()])
+        ).pack(fill=tk.X, padx=10, pady=(0, 5))
+
+        ttk.Button(
+            history_window,
+            text="🩺 Проверить библиотеку",
+            command=self.scan_library
+        ).pack(fill=tk.X, padx=10, pady=(0, 10))
+
+    def export_history(self, selected=None):
+        """Диалог экспорта истории: выбор записей, фильтр, формат и качество"""
+        selected = selected or []
+        history = self.image_storage.get_history()
+
+        dialog = tk.Toplevel(self.root)
+        dialog.title("Экспорт истории")
+        dialog.geometry("320x420")
+        dialog.transient(self.root)
+        dialog.grab_set()
+
+        # Какие записи экспортировать
+        scope_frame = ttk.LabelFrame(dialog, text="Записи")
+        scope_frame.pack(fill=tk.X, padx=10, pady=(10, 5))
+        scope_var = tk.StringVar(value="selected" if selected else "all")
+        ttk.Radiobutton(scope_frame, text=f"Все ({len(history)})",
+                        value="all", variable=scope_var).pack(anchor=tk.W, padx=10, pady=2)
+        ttk.Radiobutton(scope_frame, text=f"Выделенные ({len(selected)})",
+                        value="selected", variable=scope_var,
+                        state='normal' if selected else 'disabled').pack(anchor=tk.W, padx=10, pady=2)
+        ttk.Radiobutton(scope_frame, text="По фильтру",
+                        value="filter", variable=scope_var).pack(anchor=tk.W, padx=10, pady=2)
+
+        # Фильтр по дате (ГГГГ-ММ-ДД) и стилю
+        filter_frame = ttk.LabelFrame(dialog, text="Фильтр")
+        filter_frame.pack(fill=tk.X, padx=10, pady=5)
+        ttk.Label(filter_frame, text="С даты (ГГГГ-ММ-ДД):").grid(row=0, column=0, sticky=tk.W, padx=5, pady=2)
+        date_from = ttk.Entry(filter_frame, width=12)
+        date_from.grid(row=0, column=1, padx=5, pady=2)
+        ttk.Label(filter_frame, text="По дату (ГГГГ-ММ-ДД):").grid(row=1, column=0, sticky=tk.W, padx=5, pady=2)
+        date_to = ttk.Entry(filter_frame, width=12)
+        date_to.grid(row=1, column=1, padx=5, pady=2)
+        ttk.Label(filter_frame, text="Стиль:").grid(row=2, column=0, sticky=tk.W, padx=5, pady=2)
+        style_var = tk.StringVar(value="любой")
+        ttk.Combobox(filter_frame, textvariable=style_var, state='readonly', width=14,
+                     values=["любой"] + list(self.image_service.style_prompts)
+                     ).grid(row=2, column=1, padx=5, pady=2)
+
+        # Формат и качество перекодирования
+        format_frame = ttk.LabelFrame(dialog, text="Формат")
+        format_frame.pack(fill=tk.X, padx=10, pady=5)
+        format_var = tk.StringVar(value="original")
+        ttk.Combobox(format_frame, textvariable=format_var, state='readonly', width=14,
+                     values=["original", "png", "jpeg", "webp"]).pack(anchor=tk.W, padx=10, pady=2)
+        quality_var = tk.IntVar(value=90)
+        ttk.Label(format_frame, text="Качество (jpeg/webp):").pack(anchor=tk.W, padx=10)
+        tk.Scale(format_frame, from_=10, to=100, orient=tk.HORIZONTAL, variable=quality_var,
+                 bg=UI_CONFIG['bg_color'], fg=UI_CONFIG['text_color'],
+                 highlightthickness=0).pack(fill=tk.X, padx=10, pady=(0, 5))
+
+        def parse_date(entry):
+            value = entry.get().strip()
+            if not value:
+                return None
+            digits = value.replace('-', '')
+            if len(digits) != 8 or not digits.isdigit():
+                raise ValueError(value)
+            return digits
+
+        def start_export():
+            try:
+                since, until = parse_date(date_from), parse_date(date_to)
+            except ValueError as e:
+                messagebox.showerror("Ошибка", f"Неверная дата: {e}", parent=dialog)
+                return
+
+            entries = None
+            filter_fn = None
+            scope = scope_var.get()
+            if scope == "selected":
+                history = self.image_storage.get_history()
+                entries = [history[i] for i in selected if i < len(history)]
+            elif scope == "filter":
+                style = style_var.get()
+
+                def filter_fn(entry):
+                    # timestamp хранится как ГГГГММДД_ЧЧММСС
+                    day = entry.get('timestamp', '')[:8]
+                    if since and day < since:
+                        return False
+                    if until and day > until:
+                        return False
+                    return style == "любой" or entry.get('style') == style
+
+            target_format = format_var.get()
+            target_format = None if target_format == "original" else target_format
+            quality = quality_var.get()
+
+            dest_path = filedialog.asksaveasfilename(
+                parent=dialog,
+                title="Экспорт истории",
+                defaultextension=".zip",
+                filetypes=[("ZIP", "*.zip"), ("TAR", "*.tar"), ("TAR.GZ", "*.tar.gz")]
+            )
+            if not dest_path:
+                return
+            dialog.destroy()
+            
+            self.status_label.config(text="📦 Экспорт...")
+            
+            def on_progress(done, total):
+                # Обновляем статус не чаще, чем раз в 50 изображений
+                if done % 50 == 0 or done == total:
+                    self.root.after(0, lambda: self.status_label.config(text=f"📦 Экспорт: {done}/{total}"))
+            
+            def process_export():
+                try:
+                    exported = self.image_storage.export_history(
+                        dest_path, entries=entries, filter_fn=filter_fn, target_format=target_format,
+                        progress_callback=on_progress, quality=quality)
+                    message = f"✅ Экспортировано изображений: {exported}"
+                except Exception as e:
+                    message = f"❌ Ошибка экспорта: {e}"
+                self.root.after(0, lambda: self.status_label.config(text=message))
+            
+            self.scheduler.submit(process_export, priority=BATCH)
+
+        ttk.Button(dialog, text="📦 Экспортировать", command=start_export).pack(fill=tk.X, padx=10, pady=10)
+
+    def scan_library(self):
+        """Проверка файлов библиотеки и восстановление потерянных записей истории"""
+        self.status_label.config(text="🩺 Проверка библиотеки...")
+
+        def on_progress(done, total):
+            self.root.after(0, lambda: self.status_label.config(text=f"🩺 Проверка библиотеки: {done}/{total}"))
+
+        def process_scan():
+            try:
+                report = LibraryScanner(self.image_storage).scan(progress_callback=on_progress)
+                problems = len(report['missing']) + len(report['corrupt']) + len(report['checksum'])
+                message = (f"🩺 Проверено записей: {report['entries']}, с ошибками: {problems}, "
+                           f"восстановлено: {len(report['rebuilt'])}, файлов без записей: {len(report['orphans'])}")
+            except Exception as e:
+                message = f"❌ Ошибка проверки библиотеки: {e}"
+            self.root.after(0, lambda: show_result(message))
+
+        def show_result(message):
+            self.status_label.config(text=message)
+            # История была пуста и восстановлена - показываем последнюю запись
+            history = self.image_storage.get_history()
+            if history and self.current_history_index < 0:
+                self.current_history_index = len(history) - 1
+                self.show_history_item(self.current_history_index)
+                self.status_label.config(text=message)
+            else:
+                self.update_navigation_buttons()
+
+        self.scheduler.submit(process_scan, priority=BATCH)
+
+    def show_similar(self):
+        """Показать почти одинаковые изображения для текущего"""
+        history = self.image_storage.get_history()
+        if not (0 <= self.current_history_index < len(history)):
+            return
+        index = self.current_history_index
+        self.status_label.config(text="🔍 Поиск похожих...")
+        
+        def process_search():
+            try:
+                results = self.image_storage.find_similar(index)
+            except Exception as e:
+                print(f"Ошибка поиска похожих: {e}")
+                results = []
+            self.root.after(0, lambda: self.show_similar_results(results))
+        
+        self.scheduler.submit(process_search)
+
+    def show_similar_results(self, results):
+        """Окно со списком похожих изображений"""
+        self.status_label.config(text="")
+        if not results:
+            messagebox.showinfo("Похожие", "Похожих изображений не найдено")
+            return
+        
+        window = tk.Toplevel(self.root)
+        window.title("Похожие изображения")
+        window.geometry("600x400")
+        window.configure(bg=UI_CONFIG['bg_color'])
+        
+        results_list = tk.Listbox(window,
+                                  font=('Helvetica', 12),
+                                  bg="#2E2E2E",
+                                  fg="white")
+        results_list.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        
+        history = self.image_storage.get_history()
+        for index, distance in results:
+            item = history[index]
+            results_list.insert(tk.END,
+                                f"{index+1}. [{distance}] {item['timestamp']} - {item['description'][:50]}...")
+        
+        def on_select(event):
+            if results_list.curselection():
+                index = results[results_list.curselection()[0]][0]
+                self.current_history_index = index
+                self.show_history_item(index)
+                window.destroy()
+        
+        results_list.bind('<<ListboxSelect>>', on_select)
 
     def load_history(self):
         """Загрузка истории при старте"""
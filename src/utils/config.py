@@ -7,14 +7,120 @@ load_dotenv()
 # Конфигурация API
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
-# Проверка API ключа
-if not OPENAI_API_KEY or not OPENAI_API_KEY.startswith('sk-'):
-    raise ValueError("Ошибка: Неверный формат API ключа")
+# Адрес API (можно заменить на локальную заглушку для нагрузочных тестов)
+OPENAI_API_BASE = os.getenv('OPENAI_API_BASE', 'https://api.openai.com/v1').rstrip('/')
+
+# Ограничения частоты запросов к API (запросов в минуту)
+RATE_LIMITS = {
+    'images': int(os.getenv('NEYROTG_IMAGES_RPM', '50')),
+    'chat': int(os.getenv('NEYROTG_CHAT_RPM', '500'))
+}
+
+def require_api_key():
+    """Проверка API ключа; вызывается при создании сервиса, чтобы утилиты
+    без доступа к API (отчеты, проверка библиотеки) работали без ключа"""
+    if not OPENAI_API_KEY or not OPENAI_API_KEY.startswith('sk-'):
+        raise ValueError("Ошибка: Неверный формат API ключа")
+    return OPENAI_API_KEY
 
 # Конфигурация путей
-IMAGES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'images')
+IMAGES_DIR = os.getenv(
+    'NEYROTG_IMAGES_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), 'images')
+)
 os.makedirs(IMAGES_DIR, exist_ok=True)
 
+# Параметры генерации изображений
+IMAGE_CONFIG = {
+    'model': "dall-e-3",
+    'size': "1024x1024",
+    'quality': "standard",
+    'prompt_limit': 4000,         # максимальная длина промпта dall-e-3
+    # Быстрый черновик для прогрессивного предпросмотра
+    'draft_model': "dall-e-2",
+    'draft_size': "256x256",
+    'draft_prompt_limit': 1000
+}
+
+# Дисковая квота и уровни хранения изображений.
+# Квота включается явно: при ее превышении старые оригиналы пережимаются
+# в JPEG с потерями, а затем удаляются (остается миниатюра). 0 - без квоты
+STORAGE_CONFIG = {
+    'disk_budget_mb': int(os.getenv('NEYROTG_DISK_BUDGET_MB', '0')),
+    'keep_recent': 50,            # последние изображения всегда хранятся в оригинале
+    'compact_quality': 80,
+    'thumbnail_size': 256,
+    'retention_batch': 20,        # изображений за один проход очистки
+    'retention_interval': 60,     # секунд между проходами
+    # Архивный режим: старые изображения упаковываются в pack-файлы
+    'archive_mode': os.getenv('NEYROTG_ARCHIVE_MODE', '0') == '1',
+    'archive_keep_loose': 200     # последние изображения остаются отдельными файлами
+}
+
+# Хранилище изображений: local или s3 (S3-совместимое, например MinIO)
+STORAGE_BACKEND_CONFIG = {
+    'backend': os.getenv('NEYROTG_STORAGE_BACKEND', 'local'),
+    's3_bucket': os.getenv('NEYROTG_S3_BUCKET', 'neyrotg'),
+    's3_endpoint_url': os.getenv('NEYROTG_S3_ENDPOINT_URL'),
+    's3_prefix': os.getenv('NEYROTG_S3_PREFIX', ''),
+    'cache_mb': int(os.getenv('NEYROTG_S3_CACHE_MB', '512')),
+    'transfer_workers': 8
+}
+
+# HTTP API сервер
+SERVER_CONFIG = {
+    'host': os.getenv('NEYROTG_SERVER_HOST', '127.0.0.1'),
+    'port': int(os.getenv('NEYROTG_SERVER_PORT', '8080')),
+    'workers': int(os.getenv('NEYROTG_SERVER_WORKERS', '8')),
+    'queue_size': int(os.getenv('NEYROTG_SERVER_QUEUE', '32'))  # сверх этого - ответ 429
+}
+
+# Автоматические выключатели точек доступа API: при частых ошибках
+# или медленных ответах запросы сразу отклоняются на open_timeout секунд
+BREAKER_CONFIG = {
+    'images': {'failure_rate': 0.5, 'window': 20, 'min_calls': 4, 'slow_call_seconds': 120, 'open_timeout': 30},
+    'chat': {'failure_rate': 0.5, 'window': 20, 'min_calls': 5, 'slow_call_seconds': 60, 'open_timeout': 20}
+}
+
+# Дублирование медленных chat-запросов (включается NEYROTG_HEDGING=1):
+# копия отправляется, если ответа нет дольше квантиля задержки
+HEDGING_CONFIG = {
+    'enabled': os.getenv('NEYROTG_HEDGING', '0') == '1',
+    'quantile': 0.95,
+    'min_samples': 20,            # ответов до первого дубля
+    'max_extra_rate': 0.1,        # не больше 10% лишних запросов
+    'min_delay': 0.5              # секунд
+}
+
+# Справедливое разделение генерации между клиентами сервера и бота
+SCHEDULER_CONFIG = {
+    'tenant_concurrency': int(os.getenv('NEYROTG_TENANT_CONCURRENCY', '2')),  # заданий клиента одновременно
+    'tenant_queue': int(os.getenv('NEYROTG_TENANT_QUEUE', '16')),  # заданий клиента в очереди
+    'interactive_reserve': 1      # исполнителей, недоступных фоновым заданиям
+}
+
+# Telegram бот
+BOT_CONFIG = {
+    'token': os.getenv('TELEGRAM_BOT_TOKEN', ''),
+    # Адрес Bot API (можно заменить на локальную заглушку для тестов)
+    'api_base': os.getenv('TELEGRAM_API_BASE', 'https://api.telegram.org').rstrip('/'),
+    'workers': int(os.getenv('NEYROTG_BOT_WORKERS', '16')),  # одновременных генераций
+    'queue_size': 1000,           # заданий всех чатов в очереди
+    'chat_queue_size': 3,         # заданий в очереди одного чата
+    'poll_timeout': 30,           # секунд long polling
+    'connections': 100            # соединений с Bot API
+}
+
+# Профилирование (NEYROTG_PROFILE=1 или F12 в интерфейсе)
+PROFILE_CONFIG = {
+    'enabled': os.getenv('NEYROTG_PROFILE', '0') == '1',
+    'dir': os.getenv('NEYROTG_PROFILE_DIR', os.path.join(os.path.dirname(IMAGES_DIR), 'profiles')),
+    'slow_callback_ms': int(os.getenv('NEYROTG_SLOW_CALLBACK_MS', '100'))  # порог блокировки интерфейса
+}
+
+# Таймаут запросов перевода (секунды)
+TRANSLATION_TIMEOUT = 60
+
 # Версия приложения
 VERSION = "1.2.0"
 
@@ -42,6 +148,8 @@ UI_CONFIG = {
     'window_size': "1200x800",
     'min_width': 1000,
     'min_height': 800,
+    # Предел пикселей декодированных изображений в памяти интерфейса
+    'image_pixel_budget': int(os.getenv('NEYROTG_IMAGE_PIXEL_BUDGET', '24000000')),
     'font_family': 'Helvetica',
     'font_sizes': {
         'title': 24,
@@ -0,0 +1,161 @@
+import io
+import os
+import json
+import shutil
+import time
+import tarfile
+import zipfile
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+# Размер блока при потоковом копировании
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Расширения файлов для форматов перекодирования
+FORMAT_EXTENSIONS = {
+    'png': 'png',
+    'jpeg': 'jpg',
+    'webp': 'webp'
+}
+
+class ZipArchiveWriter:
+    """Потоковая запись в ZIP"""
+
+    def __init__(self, dest_path):
+        self.archive = zipfile.ZipFile(dest_path, 'w', allowZip64=True)
+
+    def add_stream(self, name, fileobj, size):
+        # Изображения уже сжаты, поэтому храним их без компрессии
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_STORED
+        info.file_size = size
+        with self.archive.open(info, 'w', force_zip64=True) as dest:
+            shutil.copyfileobj(fileobj, dest, COPY_CHUNK_SIZE)
+
+    def add_manifest(self, name, fileobj, size):
+        info = zipfile.ZipInfo(name, date_time=time.localtime()[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        with self.archive.open(info, 'w', force_zip64=True) as dest:
+            shutil.copyfileobj(fileobj, dest, COPY_CHUNK_SIZE)
+
+    def close(self):
+        self.archive.close()
+
+class TarArchiveWriter:
+    """Потоковая запись в TAR (с gzip для .tar.gz / .tgz)"""
+
+    def __init__(self, dest_path):
+        compressed = dest_path.endswith(('.tar.gz', '.tgz'))
+        self.archive = tarfile.open(dest_path, 'w:gz' if compressed else 'w')
+
+    def add_stream(self, name, fileobj, size):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = time.time()
+        self.archive.addfile(info, fileobj)
+
+    add_manifest = add_stream
+
+    def close(self):
+        self.archive.close()
+
+def _stream_size(fileobj):
+    """Размер файлового объекта без чтения содержимого"""
+    size = fileobj.seek(0, io.SEEK_END)
+    fileobj.seek(0)
+    return size
+
+def _reencode(storage, image_path, target_format, quality=90):
+    """Перекодирование изображения в заданный формат, возвращает байты"""
+    image = storage.load_image(image_path)
+    if image is None:
+        return None
+    if target_format == 'jpeg' and image.mode != 'RGB':
+        if image.mode in ('RGBA', 'LA'):
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            background.paste(image, mask=image.split()[-1])
+            image = background
+        else:
+            image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, target_format.upper(), quality=quality)
+    return buffer.getvalue()
+
+def export_entries(storage, dest_path, entries, target_format=None, workers=4, progress_callback=None,
+                   quality=90):
+    """Потоковый экспорт записей истории и изображений в ZIP или TAR с манифестом.
+    quality применяется только при перекодировании в jpeg/webp.
+    Возвращает число экспортированных изображений"""
+    if dest_path.endswith('.zip'):
+        writer = ZipArchiveWriter(dest_path)
+    else:
+        writer = TarArchiveWriter(dest_path)
+
+    total = len(entries)
+    exported = 0
+    # Манифест пишется построчно во временный файл, чтобы не держать его в памяти
+    manifest = tempfile.TemporaryFile()
+
+    def write_entry(entry, archive_name, source):
+        nonlocal exported
+        record = dict(entry)
+        if source is not None:
+            record['archive_path'] = archive_name
+            exported += 1
+        else:
+            record['missing'] = True
+        manifest.write((json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8'))
+
+    try:
+        if target_format:
+            extension = FORMAT_EXTENSIONS.get(target_format, target_format)
+
+            def encode(entry):
+                return _reencode(storage, entry['image_path'], target_format, quality)
+
+            # Ограниченное окно задач: в памяти не больше 2 * workers изображений
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                pending = deque()
+                entry_iter = iter(entries)
+                for entry in entry_iter:
+                    pending.append((entry, executor.submit(encode, entry)))
+                    if len(pending) >= workers * 2:
+                        break
+
+                done = 0
+                while pending:
+                    entry, future = pending.popleft()
+                    next_entry = next(entry_iter, None)
+                    if next_entry is not None:
+                        pending.append((next_entry, executor.submit(encode, next_entry)))
+
+                    data = future.result()
+                    stem = os.path.splitext(os.path.basename(entry['image_path']))[0]
+                    archive_name = f'images/{stem}.{extension}'
+                    if data is not None:
+                        writer.add_stream(archive_name, io.BytesIO(data), len(data))
+                    write_entry(entry, archive_name, data)
+
+                    done += 1
+                    if progress_callback:
+                        progress_callback(done, total)
+        else:
+            for done, entry in enumerate(entries, 1):
+                archive_name = f"images/{entry['image_path']}"
+                with storage.open_image_file(entry['image_path']) as f:
+                    if f is not None:
+                        writer.add_stream(archive_name, f, _stream_size(f))
+                    write_entry(entry, archive_name, f)
+                if progress_callback:
+                    progress_callback(done, total)
+
+        manifest_size = manifest.tell()
+        manifest.seek(0)
+        writer.add_manifest('manifest.jsonl', manifest, manifest_size)
+    finally:
+        manifest.close()
+        writer.close()
+
+    return exported
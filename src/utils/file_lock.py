@@ -0,0 +1,69 @@
+import os
+import time
+import threading
+
+if os.name == 'nt':
+    import msvcrt
+else:
+    import fcntl
+
+class FileLock:
+    """Межпроцессная блокировка на основе lock-файла.
+    Повторный захват из того же потока допускается"""
+
+    def __init__(self, path):
+        self.path = path
+        self.thread_lock = threading.RLock()
+        self.depth = 0
+        self.handle = None
+
+    def acquire(self):
+        self.thread_lock.acquire()
+        if self.depth == 0:
+            try:
+                self.handle = open(self.path, 'a+b')
+                self._lock_file()
+            except Exception:
+                if self.handle:
+                    self.handle.close()
+                    self.handle = None
+                self.thread_lock.release()
+                raise
+        self.depth += 1
+
+    def release(self):
+        self.depth -= 1
+        if self.depth == 0:
+            try:
+                self._unlock_file()
+            finally:
+                self.handle.close()
+                self.handle = None
+        self.thread_lock.release()
+
+    def _lock_file(self):
+        if os.name == 'nt':
+            self.handle.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.handle.fileno(), msvcrt.LK_LOCK, 1)
+                    return
+                except OSError:
+                    # LK_LOCK сдается через 10 секунд, продолжаем ждать
+                    time.sleep(0.1)
+        else:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_EX)
+
+    def _unlock_file(self):
+        if os.name == 'nt':
+            self.handle.seek(0)
+            msvcrt.locking(self.handle.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(self.handle.fileno(), fcntl.LOCK_UN)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
@@ -0,0 +1,222 @@
+import io
+import os
+import json
+import mmap
+import threading
+from .file_lock import FileLock
+
+# Максимальный размер одного pack-файла
+PACK_MAX_SIZE = 256 * 1024 * 1024
+
+class PackSlice(io.RawIOBase):
+    """Файловый объект только для чтения поверх участка отображенного в память pack-файла"""
+
+    def __init__(self, buffer, offset, length):
+        self.view = memoryview(buffer)[offset:offset + length]
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, target):
+        size = min(len(target), len(self.view) - self.position)
+        if size <= 0:
+            return 0
+        target[:size] = self.view[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += len(self.view)
+        self.position = max(offset, 0)
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def close(self):
+        if not self.closed:
+            self.view.release()
+        super().close()
+
+class ImagePack:
+    """Архив изображений: append-only pack-файлы с индексом смещений"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_file = os.path.join(directory, 'index.json')
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # Дозапись из нескольких процессов сериализуется через lock-файл
+        self.file_lock = FileLock(os.path.join(directory, 'index.lock'))
+        self.maps = {}
+        self.index_signature = None
+        self._load_index()
+
+    def _index_file_signature(self):
+        try:
+            stat = os.stat(self.index_file)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def _load_index(self):
+        """Загрузка индекса: имя изображения -> [pack-файл, смещение, длина]"""
+        if os.path.exists(self.index_file):
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        else:
+            self.index = {}
+        self.index_signature = self._index_file_signature()
+
+    def _refresh_index(self):
+        """Перечитывание индекса, если его дополнил другой процесс"""
+        if self._index_file_signature() != self.index_signature:
+            self._load_index()
+
+    def _save_index(self):
+        """Атомарная запись индекса"""
+        tmp_file = f'{self.index_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f)
+        os.replace(tmp_file, self.index_file)
+
+    def __contains__(self, name):
+        if name in self.index:
+            return True
+        with self.lock:
+            self._refresh_index()
+            return name in self.index
+
+    def _current_pack(self):
+        """Pack-файл для дозаписи: последний, пока он не превысил лимит"""
+        packs = sorted(f for f in os.listdir(self.directory) if f.endswith('.pack'))
+        if packs:
+            last = packs[-1]
+            if os.path.getsize(os.path.join(self.directory, last)) < PACK_MAX_SIZE:
+                return last
+            number = int(last[len('pack_'):-len('.pack')]) + 1
+        else:
+            number = 1
+        return f'pack_{number:04d}.pack'
+
+    def add_files(self, files):
+        """Дозапись файлов в архив. files - список пар (имя, путь к файлу)"""
+        with self.lock, self.file_lock:
+            self._load_index()
+            pack_name = self._current_pack()
+            pack_path = os.path.join(self.directory, pack_name)
+            with open(pack_path, 'ab') as pack:
+                for name, path in files:
+                    # Файл мог уже упаковать другой процесс
+                    if name in self.index:
+                        continue
+                    try:
+                        with open(path, 'rb') as f:
+                            data = f.read()
+                    except FileNotFoundError:
+                        continue
+                    offset = pack.tell()
+                    pack.write(data)
+                    self.index[name] = [pack_name, offset, len(data)]
+                pack.flush()
+                os.fsync(pack.fileno())
+            # Индекс записываем только после того, как данные на диске
+            self._save_index()
+
+    def _get_map(self, pack_name, required_size):
+        """Отображение pack-файла в память, с переоткрытием после дозаписи"""
+        mapped = self.maps.get(pack_name)
+        if mapped is None or len(mapped) < required_size:
+            with open(os.path.join(self.directory, pack_name), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            # Старое отображение закроется сборщиком мусора, когда с ним закончат читатели
+            self.maps[pack_name] = mapped
+        return mapped
+
+    def open(self, name):
+        """Открытие изображения из архива без копирования всего файла"""
+        with self.lock:
+            if name not in self.index:
+                self._refresh_index()
+            pack_name, offset, length = self.index[name]
+            mapped = self._get_map(pack_name, offset + length)
+            return PackSlice(mapped, offset, length)
+
+    def remove(self, names):
+        """Исключение изображений из архива; место освобождается при перепаковке"""
+        with self.lock, self.file_lock:
+            self._load_index()
+            removed = [name for name in names if self.index.pop(name, None) is not None]
+            if removed:
+                self._save_index()
+        return len(removed)
+
+    def total_bytes(self):
+        """Размер всех pack-файлов на диске"""
+        return sum(os.path.getsize(os.path.join(self.directory, f))
+                   for f in os.listdir(self.directory) if f.endswith('.pack'))
+
+    def _next_pack_name(self):
+        packs = sorted(f for f in os.listdir(self.directory) if f.endswith('.pack'))
+        number = int(packs[-1][len('pack_'):-len('.pack')]) + 1 if packs else 1
+        return f'pack_{number:04d}.pack'
+
+    def repack(self, min_garbage=0.25):
+        """Перезапись pack-файлов, в которых удаленные изображения занимают
+        не меньше min_garbage от размера. Возвращает число освобожденных байт"""
+        with self.lock:
+            self._refresh_index()
+            live = {}
+            for name, (pack_name, offset, length) in self.index.items():
+                live.setdefault(pack_name, []).append((name, offset, length))
+
+        freed = 0
+        for pack_name in sorted(f for f in os.listdir(self.directory) if f.endswith('.pack')):
+            path = os.path.join(self.directory, pack_name)
+            size = os.path.getsize(path)
+            slices = sorted(live.get(pack_name, []), key=lambda item: item[1])
+            used = sum(length for _, _, length in slices)
+            if not size or (size - used) / size < min_garbage:
+                continue
+
+            # Живые участки копируются во временный файл без блокировок,
+            # индекс меняется в конце
+            moved = {}
+            tmp_path = os.path.join(self.directory, f'repack.{os.getpid()}.{threading.get_ident()}.tmp')
+            if slices:
+                with open(path, 'rb') as source, open(tmp_path, 'wb') as target:
+                    for name, offset, length in slices:
+                        source.seek(offset)
+                        moved[name] = ([pack_name, offset, length], target.tell())
+                        target.write(source.read(length))
+                    target.flush()
+                    os.fsync(target.fileno())
+
+            with self.lock, self.file_lock:
+                self._load_index()
+                if moved:
+                    new_name = self._next_pack_name()
+                    os.replace(tmp_path, os.path.join(self.directory, new_name))
+                    # Изображения, удаленные или перемещенные за время копирования, не трогаем
+                    for name, (old_location, new_offset) in moved.items():
+                        if self.index.get(name) == old_location:
+                            self.index[name] = [new_name, new_offset, old_location[2]]
+                    self._save_index()
+                still_used = any(location[0] == pack_name for location in self.index.values())
+                self.maps.pop(pack_name, None)
+            if still_used:
+                continue
+            try:
+                os.remove(path)
+                freed += size - used
+            except OSError as e:
+                # В Windows файл, отображенный в память, удалить нельзя - повторим позже
+                print(f"Не удалось удалить pack-файл {pack_name}: {e}")
+        return freed
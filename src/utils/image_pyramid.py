@@ -0,0 +1,45 @@
+from PIL import Image
+
+# Режимы, которые поддерживает Image.reduce
+REDUCIBLE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'RGBa', 'La', 'I', 'F')
+
+class ImagePyramid:
+    """Многоуровневое представление изображения для быстрого масштабирования"""
+
+    def __init__(self, image, min_size=128):
+        if image.mode not in REDUCIBLE_MODES:
+            image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+        # Уровень 0 - оригинал, каждый следующий вдвое меньше предыдущего
+        self.levels = [image]
+        level = image
+        while min(level.size) // 2 >= min_size:
+            level = level.reduce(2)
+            self.levels.append(level)
+
+    @property
+    def size(self):
+        """Размер исходного изображения"""
+        return self.levels[0].size
+
+    def level_for(self, width, height):
+        """Наименьший уровень, который не меньше требуемого размера"""
+        for level in reversed(self.levels):
+            if level.width >= width and level.height >= height:
+                return level
+        return self.levels[0]
+
+    def render(self, width, height, resample=Image.Resampling.LANCZOS):
+        """Получение изображения заданного размера из ближайшего уровня"""
+        level = self.level_for(width, height)
+        if level.size == (width, height):
+            return level
+        return level.resize((width, height), resample)
+
+    def fit(self, max_width, max_height, resample=Image.Resampling.LANCZOS):
+        """Вписывание изображения в заданные границы с сохранением пропорций"""
+        img_width, img_height = self.size
+        ratio = min(max_width/img_width, max_height/img_height)
+        new_width = max(int(img_width * ratio), 1)
+        new_height = max(int(img_height * ratio), 1)
+        return self.render(new_width, new_height, resample)
@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+from PIL import Image
+
+class ImageResidency:
+    """Учет декодированных изображений PIL и PhotoImage с ограничением по пикселям.
+
+    Объекты регистрируются под владельцем (панель, окно увеличения). При
+    освобождении владельца изображения PIL закрываются, а PhotoImage теряют
+    последние ссылки и удаляются из Tk. Если сумма пикселей превышает бюджет,
+    освобождаются давно использованные незакрепленные владельцы."""
+
+    def __init__(self, pixel_budget):
+        self.pixel_budget = pixel_budget
+        self.owners = OrderedDict()
+        self.lock = threading.RLock()
+        self.evictions = 0
+
+    @staticmethod
+    def _pixels(obj):
+        if isinstance(obj, Image.Image):
+            return obj.width * obj.height
+        return obj.width() * obj.height()
+
+    def track(self, owner, obj, on_release=None, pinned=False):
+        """Регистрация объекта; on_release вызывается при освобождении владельца"""
+        with self.lock:
+            record = self.owners.get(owner)
+            if record is None:
+                record = self.owners[owner] = {'objects': [], 'pixels': 0, 'on_release': None, 'pinned': False}
+            if all(existing is not obj for existing in record['objects']):
+                record['objects'].append(obj)
+                record['pixels'] += self._pixels(obj)
+            if on_release is not None:
+                record['on_release'] = on_release
+            record['pinned'] = record['pinned'] or pinned
+            self.owners.move_to_end(owner)
+        self._enforce_budget(owner)
+        return obj
+
+    def touch(self, owner):
+        """Отметка использования: владелец вытесняется последним"""
+        with self.lock:
+            if owner in self.owners:
+                self.owners.move_to_end(owner)
+
+    def release(self, owner):
+        """Освобождение всех объектов владельца"""
+        with self.lock:
+            record = self.owners.pop(owner, None)
+        if record is None:
+            return
+        if record['on_release']:
+            try:
+                record['on_release']()
+            except Exception as e:
+                print(f"Ошибка при освобождении изображений {owner}: {e}")
+        for obj in record['objects']:
+            if isinstance(obj, Image.Image):
+                obj.close()
+        record['objects'].clear()
+
+    def _enforce_budget(self, keep):
+        """Вытеснение давно использованных владельцев сверх бюджета"""
+        while True:
+            with self.lock:
+                total = sum(record['pixels'] for record in self.owners.values())
+                if total <= self.pixel_budget:
+                    return
+                victim = next(
+                    (owner for owner, record in self.owners.items() if not record['pinned'] and owner != keep),
+                    None
+                )
+                if victim is None:
+                    return
+                self.evictions += 1
+            self.release(victim)
+
+    def usage(self):
+        """Текущее потребление для мониторинга"""
+        with self.lock:
+            pixels = sum(record['pixels'] for record in self.owners.values())
+            return {
+                'owners': len(self.owners),
+                'objects': sum(len(record['objects']) for record in self.owners.values()),
+                'pixels': pixels,
+                # Tk и PIL в RGB(A) хранят до 4 байт на пиксель
+                'bytes_estimate': pixels * 4,
+                'pixel_budget': self.pixel_budget,
+                'evictions': self.evictions
+            }
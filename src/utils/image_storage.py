@@ -1,63 +1,387 @@
 import os
 import json
+import hashlib
 from datetime import datetime
 from PIL import Image
+from PIL.PngImagePlugin import PngInfo
 from io import BytesIO
+import time
+import uuid
+import threading
+from contextlib import contextmanager
 import requests
-from .config import IMAGES_DIR
+from .config import IMAGES_DIR, STORAGE_CONFIG, STORAGE_BACKEND_CONFIG
+from .file_lock import FileLock
+from .storage_backends import create_backend, ReadThroughCache
+from .image_pack import ImagePack
+from .perceptual_index import PerceptualIndex, dhash
+from .visual_index import VisualIndex, extract_features
+from .exporter import export_entries
+
+# Уровни хранения изображений
+TIER_FULL = 'full'          # оригинал без изменений
+TIER_COMPACT = 'compact'    # пережатая копия и миниатюра
+TIER_EVICTED = 'evicted'    # осталась только миниатюра
+
+# Поля записи истории, которые дублируются в самом файле изображения,
+# чтобы историю можно было восстановить по файлам
+EMBEDDED_FIELDS = ('id', 'timestamp', 'description', 'style', 'model', 'size',
+                   'quality', 'revised_prompt', 'cache_key')
+EMBEDDED_KEY = 'neyrotg'
+
+def embedded_metadata(entry):
+    """Сериализация метаданных записи для встраивания в файл"""
+    return json.dumps({field: entry[field] for field in EMBEDDED_FIELDS if field in entry})
+
+def read_embedded_metadata(image):
+    """Метаданные, встроенные в PNG (текстовый блок) или JPEG (комментарий)"""
+    value = image.info.get(EMBEDDED_KEY) or image.info.get('comment')
+    if not value:
+        return {}
+    try:
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        metadata = json.loads(value)
+    except ValueError:
+        return {}
+    return metadata if isinstance(metadata, dict) else {}
+
+# Поля, описывающие локальное хранение изображения. Уровни хранения и архив -
+# дело квоты конкретного рабочего места, в общую историю они не попадают
+LOCAL_FIELDS = ('tier', 'thumbnail_path', 'packed', 'original_path', 'original_format', 'damaged')
+# Описывают файл, на который указывает image_path; у пережатой копии свои
+FILE_FIELDS = ('sha256', 'file_bytes')
+
+def shared_entry(entry):
+    """Запись для общей истории: всегда ссылается на оригинал изображения"""
+    shared = {field: value for field, value in entry.items() if field not in LOCAL_FIELDS}
+    if entry.get('original_path'):
+        shared['image_path'] = entry['original_path']
+        shared['format'] = entry.get('original_format', shared.get('format'))
+        for field in FILE_FIELDS:
+            shared.pop(field, None)
+    return shared
+
+def merge_entry(local, remote):
+    """Запись из общей истории поверх локальной с сохранением локального хранения"""
+    merged = dict(remote)
+    for field in LOCAL_FIELDS + FILE_FIELDS:
+        if field in local:
+            merged[field] = local[field]
+    if local.get('original_path'):
+        merged['image_path'] = local['image_path']
+        merged['format'] = local.get('format')
+    return merged
+
+def entry_key(entry):
+    """Постоянный ключ записи истории (у старых записей - исходное имя файла)"""
+    return entry.get('id') or os.path.splitext(entry['image_path'])[0]
 
 class ImageStorage:
     def __init__(self):
         self.history_file = os.path.join(IMAGES_DIR, 'history.json')
+        # История изменяется из UI и из фоновой очистки
+        self.lock = threading.RLock()
+        # Каталог могут одновременно использовать несколько процессов
+        self.file_lock = FileLock(os.path.join(IMAGES_DIR, 'history.lock'))
+        self.history_signature = None
+        self.pack = ImagePack(os.path.join(IMAGES_DIR, 'packs'))
+        
+        # Общее хранилище и локальный кеш скачанных из него изображений
+        self.backend = create_backend(IMAGES_DIR)
+        self.remote_cache = None
+        if self.backend.remote:
+            self.remote_cache = ReadThroughCache(
+                self.backend,
+                os.path.join(IMAGES_DIR, 'cache'),
+                STORAGE_BACKEND_CONFIG['cache_mb'] * 1024 * 1024
+            )
+        self.sync_lock = threading.Lock()
+        
+        # Индекс перцептивных хешей для поиска почти одинаковых изображений
+        self.phash_index = PerceptualIndex(IMAGES_DIR)
+        # Индекс визуальных признаков для поиска похожих по виду
+        self.visual_index = VisualIndex(IMAGES_DIR)
+        
         self._load_history()
+        self.sync_history_async()
+
+    def _history_file_signature(self):
+        """Время изменения и размер файла истории для обнаружения чужих записей"""
+        try:
+            stat = os.stat(self.history_file)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def _read_history_file(self):
+        """Чтение истории с диска"""
+        if os.path.exists(self.history_file):
+            try:
+                with open(self.history_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            except ValueError as e:
+                # Поврежденный файл откладываем: из него и из файлов изображений
+                # историю восстанавливает library_scanner
+                damaged_file = f'{self.history_file}.damaged.{datetime.now().strftime("%Y%m%d_%H%M%S")}'
+                os.replace(self.history_file, damaged_file)
+                print(f"Файл истории поврежден ({e}), сохранен как {damaged_file}")
+        return []
 
     def _load_history(self):
         """Загрузка истории из файла"""
-        if os.path.exists(self.history_file):
-            with open(self.history_file, 'r', encoding='utf-8') as f:
-                self.history = json.load(f)
+        with self.lock, self.file_lock:
+            self.history = self._read_history_file()
+            self.history_signature = self._history_file_signature()
+            self._build_cache_index()
+
+    def refresh_if_changed(self):
+        """Перечитывание истории, если ее изменил другой процесс.
+        Возвращает True, если история обновилась"""
+        if self._history_file_signature() == self.history_signature:
+            return False
+        self._load_history()
+        return True
+
+    def _update_history(self, mutator):
+        """Транзакционное изменение истории: под межпроцессной блокировкой
+        читаем актуальную версию с диска, применяем изменение и атомарно записываем"""
+        with self.lock, self.file_lock:
+            history = self._read_history_file()
+            result = mutator(history)
+            
+            tmp_file = f'{self.history_file}.{os.getpid()}.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(history, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.history_file)
+            
+            self.history = history
+            self.history_signature = self._history_file_signature()
+            self._build_cache_index()
+            return result
+
+    def sync_history(self):
+        """Слияние локальной истории с историей в общем хранилище"""
+        if not self.backend.remote:
+            return
+        with self.sync_lock:
+            remote_file = f'{self.history_file}.remote'
+            remote_history = []
+            if self.backend.download('history.json', remote_file):
+                with open(remote_file, 'r', encoding='utf-8') as f:
+                    remote_history = json.load(f)
+                os.remove(remote_file)
+            
+            def merge(history):
+                # Изменения полей переносятся по версии записи (updated_at) в обе стороны
+                positions = {entry_key(entry): i for i, entry in enumerate(history)}
+                missing = []
+                for remote_entry in remote_history:
+                    position = positions.get(entry_key(remote_entry))
+                    if position is None:
+                        missing.append(remote_entry)
+                    elif remote_entry.get('updated_at', 0) > history[position].get('updated_at', 0):
+                        history[position] = merge_entry(history[position], remote_entry)
+                # Новые записи добавляются в конец: индексы уже показанных не сдвигаются
+                history.extend(sorted(missing, key=lambda entry: entry['timestamp']))
+                return [shared_entry(entry) for entry in history]
+            
+            shared_history = self._update_history(merge)
+            shared_file = f'{self.history_file}.{os.getpid()}.shared'
+            with open(shared_file, 'w', encoding='utf-8') as f:
+                json.dump(shared_history, f, ensure_ascii=False, indent=2)
+            try:
+                self.backend.upload('history.json', shared_file).result()
+            finally:
+                os.remove(shared_file)
+
+    def sync_history_async(self):
+        """Фоновая синхронизация истории с общим хранилищем"""
+        if not self.backend.remote:
+            return
+        
+        def run():
+            try:
+                self.sync_history()
+            except Exception as e:
+                print(f"Ошибка синхронизации истории: {str(e)}")
+        
+        threading.Thread(target=run, daemon=True).start()
+
+    def update_entries(self, changes):
+        """Изменение полей записей истории. changes - словарь {ключ записи: {поле: значение}}"""
+        now = time.time()
+        def apply(history):
+            for entry in history:
+                entry_changes = changes.get(entry_key(entry))
+                if entry_changes:
+                    entry.update(entry_changes)
+                    # Версия растет только при изменении полей, общих для всех рабочих мест
+                    if any(field not in LOCAL_FIELDS + FILE_FIELDS + ('id',) for field in entry_changes):
+                        entry['updated_at'] = now
+        self._update_history(apply)
+
+    def _build_cache_index(self):
+        """Построение индекса повторного использования по ключу промпта"""
+        self.cache_index = {}
+        self.key_index = {}
+        for index, entry in enumerate(self.history):
+            self.key_index[entry_key(entry)] = index
+            cache_key = entry.get('cache_key')
+            if cache_key:
+                # Более поздние записи перекрывают ранние
+                self.cache_index[cache_key] = index
+
+    def find_cached(self, cache_key):
+        """Поиск ранее созданного изображения по ключу промпта"""
+        index = self.cache_index.get(cache_key)
+        if index is None:
+            return None
+        entry = self.history[index]
+        # Пережатые копии не подходят для повторного использования
+        if entry.get('tier', TIER_FULL) != TIER_FULL:
+            return None
+        if not self.has_image(entry['image_path']):
+            return None
+        return index
+
+    def has_image(self, image_path):
+        """Проверка наличия изображения в каталоге, архиве или общем хранилище"""
+        if os.path.exists(os.path.join(IMAGES_DIR, image_path)) or image_path in self.pack:
+            return True
+        return self.backend.remote and self.backend.exists(image_path)
+
+    @contextmanager
+    def open_image_file(self, image_path):
+        """Открытие файла изображения: отдельного файла или участка pack-файла.
+        Возвращает None, если изображения нет"""
+        full_path = os.path.join(IMAGES_DIR, image_path)
+        if os.path.exists(full_path):
+            with open(full_path, 'rb') as f:
+                yield f
+        elif image_path in self.pack:
+            with self.pack.open(image_path) as f:
+                yield f
         else:
-            self.history = []
+            # Изображение из общего хранилища скачивается в локальный кеш
+            cached_path = self.remote_cache.get(image_path) if self.remote_cache else None
+            if cached_path:
+                with open(cached_path, 'rb') as f:
+                    yield f
+            else:
+                yield None
+
+    def archive_old_images(self, keep_loose=None):
+        """Упаковка старых изображений в pack-файлы. Возвращает число упакованных файлов"""
+        if keep_loose is None:
+            keep_loose = STORAGE_CONFIG['archive_keep_loose']
+        
+        with self.lock:
+            candidates = self.history[:max(len(self.history) - keep_loose, 0)]
+        
+        files = []
+        archived_entries = []
+        for entry in candidates:
+            entry_files = []
+            for key in ('image_path', 'thumbnail_path'):
+                name = entry.get(key)
+                if name and name not in self.pack:
+                    path = os.path.join(IMAGES_DIR, name)
+                    if os.path.exists(path):
+                        entry_files.append((name, path))
+            if entry_files:
+                files.extend(entry_files)
+                archived_entries.append(entry)
+        
+        if not files:
+            return 0
+        
+        self.pack.add_files(files)
+        for name, path in files:
+            try:
+                os.remove(path)
+            except OSError as e:
+                # Отдельный файл имеет приоритет при чтении, удалим в следующий раз
+                print(f"Не удалось удалить упакованный файл {name}: {e}")
+        
+        self.update_entries({entry_key(entry): {'packed': True} for entry in archived_entries})
+        return len(files)
 
-    def save_image(self, image_url, description, format="png"):
-        """Сохранение изображения и информации о нем"""
+    def save_image(self, image_url, description, format="png", cache_key=None, metadata=None):
+        """Сохранение изображения и информации о нем.
+        metadata - параметры генерации (стиль, модель, задержка API и т.д.)"""
         try:
             # Загрузка изображения
-            response = requests.get(image_url)
-            response.raise_for_status()
+            started = time.perf_counter()
+            content = self._download_bytes(image_url)
+            download_time = time.perf_counter() - started
+            image = Image.open(BytesIO(content))
             
-            # Открываем изображение
-            image = Image.open(BytesIO(response.content))
-            
-            # Генерация имени файла
+            # Генерация имени файла, уникального и между процессами
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            image_filename = f'image_{timestamp}.{format}'
+            image_id = f'image_{timestamp}_{uuid.uuid4().hex[:8]}'
+            image_filename = f'{image_id}.{format}'
             image_path = os.path.join(IMAGES_DIR, image_filename)
             
-            # Сохранение изображения в нужном формате
+            history_entry = {
+                'id': image_id,
+                'timestamp': timestamp,
+                'description': description,
+                'image_path': image_filename,
+                'format': format
+            }
+            if metadata:
+                history_entry.update(metadata)
+            if cache_key:
+                history_entry['cache_key'] = cache_key
+            
+            # Сохранение изображения в нужном формате вместе с метаданными записи
+            started = time.perf_counter()
+            buffer = BytesIO()
             if format.lower() == 'jpeg':
                 # Для JPEG конвертируем в RGB и устанавливаем качество
                 if image.mode in ('RGBA', 'LA'):
                     background = Image.new('RGB', image.size, (255, 255, 255))
                     background.paste(image, mask=image.split()[-1])
                     image = background
-                image.save(image_path, 'JPEG', quality=95)
+                image.save(buffer, 'JPEG', quality=95, comment=embedded_metadata(history_entry))
             else:
                 # Для PNG сохраняем как есть
-                image.save(image_path, 'PNG')
+                png_info = PngInfo()
+                png_info.add_text(EMBEDDED_KEY, embedded_metadata(history_entry))
+                image.save(buffer, 'PNG', pnginfo=png_info)
+            data = buffer.getvalue()
+            with open(image_path, 'wb') as f:
+                f.write(data)
+            encode_time = time.perf_counter() - started
             
-            # Добавление в историю
-            history_entry = {
-                'timestamp': timestamp,
-                'description': description,
-                'image_path': image_filename,
-                'format': format
-            }
-            self.history.append(history_entry)
+            # Метрики и контрольная сумма файла для проверки целостности
+            history_entry.update({
+                'download_time': round(download_time, 3),
+                'bytes': len(content),
+                'file_bytes': len(data),
+                'encode_time': round(encode_time, 3),
+                'sha256': hashlib.sha256(data).hexdigest(),
+                # Версия записи для слияния истории между рабочими местами
+                'updated_at': time.time()
+            })
+            
+            # Хеш и признаки считаем по уже декодированному изображению
+            try:
+                self.phash_index.add(image_id, dhash(image))
+                # Индексы пишутся на диск с задержкой, а не целиком на каждое изображение
+                self.phash_index.maybe_save()
+                self.visual_index.add(image_id, extract_features(image))
+                self.visual_index.maybe_save()
+            except Exception as e:
+                print(f"Ошибка при индексации изображения: {str(e)}")
             
             # Сохранение истории
-            with open(self.history_file, 'w', encoding='utf-8') as f:
-                json.dump(self.history, f, ensure_ascii=False, indent=2)
+            self._update_history(lambda history: history.append(history_entry))
+            
+            # Копия в общее хранилище загружается в фоне
+            self.backend.upload(image_filename, image_path)
+            self.sync_history_async()
             
             return image_path
             
@@ -65,6 +389,170 @@ class ImageStorage:
             print(f"Ошибка при сохранении изображения: {str(e)}")
             return None
 
+    def compact_entry(self, entry):
+        """Перевод изображения в компактный уровень: JPEG-копия и миниатюра.
+        Возвращает число освобожденных байт или None, если запись пропущена"""
+        original_path = os.path.join(IMAGES_DIR, entry['image_path'])
+        # Упакованный оригинал исключается из архива, место вернет перепаковка
+        packed = not os.path.exists(original_path)
+        if packed and entry['image_path'] not in self.pack:
+            return None
+        
+        stem = os.path.splitext(entry['image_path'])[0]
+        compact_filename = f'{stem}_compact.jpg'
+        thumbnail_filename = f'{stem}_thumb.jpg'
+        compact_path = os.path.join(IMAGES_DIR, compact_filename)
+        thumbnail_path = os.path.join(IMAGES_DIR, thumbnail_filename)
+        
+        with self.open_image_file(entry['image_path']) as f:
+            original_size = f.seek(0, 2)
+            f.seek(0)
+            with Image.open(f) as image:
+                image = image.convert('RGB')
+        # Копии сохраняют метаданные записи для восстановления истории
+        comment = embedded_metadata(entry)
+        image.save(compact_path, 'JPEG', quality=STORAGE_CONFIG['compact_quality'], optimize=True, comment=comment)
+        thumbnail_size = STORAGE_CONFIG['thumbnail_size']
+        image.thumbnail((thumbnail_size, thumbnail_size), Image.Resampling.LANCZOS)
+        image.save(thumbnail_path, 'JPEG', quality=85, comment=comment)
+        
+        # Уровни хранения локальны: в общей истории и хранилище остается оригинал
+        self.update_entries({entry_key(entry): {
+            'id': entry_key(entry),
+            'original_path': entry['image_path'],
+            'original_format': entry.get('format', 'png'),
+            'image_path': compact_filename,
+            'thumbnail_path': thumbnail_filename,
+            'format': 'jpeg',
+            'tier': TIER_COMPACT,
+            # Копии - отдельные файлы, при следующей архивации их упакуют снова
+            'packed': False,
+            # Контрольную сумму новой копии запишет проверка библиотеки
+            'sha256': None
+        }})
+        if packed:
+            self.pack.remove([entry['image_path']])
+        else:
+            os.remove(original_path)
+        
+        return original_size - os.path.getsize(compact_path) - os.path.getsize(thumbnail_path)
+
+    def evict_entry(self, entry):
+        """Удаление копии изображения, в истории остается только миниатюра.
+        Возвращает число освобожденных байт или None, если запись пропущена"""
+        thumbnail = entry.get('thumbnail_path')
+        if not thumbnail or not (os.path.exists(os.path.join(IMAGES_DIR, thumbnail)) or thumbnail in self.pack):
+            return None
+        
+        self.update_entries({entry_key(entry): {
+            'id': entry_key(entry),
+            'original_path': entry.get('original_path') or entry['image_path'],
+            'original_format': entry.get('original_format') or entry.get('format', 'png'),
+            'image_path': thumbnail,
+            'tier': TIER_EVICTED,
+            'sha256': None
+        }})
+        
+        image_path = os.path.join(IMAGES_DIR, entry['image_path'])
+        freed = 0
+        if os.path.exists(image_path):
+            freed = os.path.getsize(image_path)
+            os.remove(image_path)
+        elif entry['image_path'] in self.pack:
+            with self.pack.open(entry['image_path']) as f:
+                freed = f.seek(0, 2)
+            self.pack.remove([entry['image_path']])
+        return freed
+
+    def find_similar(self, index, max_distance=10, limit=20):
+        """Поиск почти одинаковых изображений для записи истории.
+        Возвращает список пар (индекс в истории, расстояние Хэмминга)"""
+        with self.lock:
+            key = entry_key(self.history[index])
+        value = self.phash_index.get(key)
+        if value is None:
+            image = self.load_preview(self.history[index]['image_path'], (64, 64))
+            if image is None:
+                return []
+            value = dhash(image)
+            self.phash_index.add(key, value)
+        
+        results = []
+        with self.lock:
+            for similar_key, distance in self.phash_index.query(value, max_distance, limit + 1):
+                similar_index = self.key_index.get(similar_key)
+                if similar_index is not None and similar_index != index:
+                    results.append((similar_index, distance))
+        return results[:limit]
+
+    def find_visually_similar(self, index, k=20):
+        """Поиск изображений, похожих по виду на запись истории.
+        Возвращает список пар (индекс в истории, косинусная близость)"""
+        with self.lock:
+            key = entry_key(self.history[index])
+        features = self.visual_index.get(key)
+        if features is None:
+            image = self.load_preview(self.history[index]['image_path'], (64, 64))
+            if image is None:
+                return []
+            features = extract_features(image)
+            self.visual_index.add(key, features)
+        
+        results = []
+        with self.lock:
+            for similar_key, score in self.visual_index.query(features, k + 1):
+                similar_index = self.key_index.get(similar_key)
+                if similar_index is not None and similar_index != index:
+                    results.append((similar_index, score))
+        return results[:k]
+
+    def backfill_indexes(self, batch_size=100):
+        """Расчет хешей и визуальных признаков для изображений, сохраненных без них.
+        Возвращает число обработанных изображений"""
+        with self.lock:
+            pending = [entry for entry in self.history
+                       if entry_key(entry) not in self.phash_index
+                       or entry_key(entry) not in self.visual_index]
+        
+        processed = 0
+        for entry in pending:
+            # Для хеша и признаков достаточно сильно уменьшенного декодирования
+            image = self.load_preview(entry['image_path'], (64, 64))
+            if image is None:
+                continue
+            key = entry_key(entry)
+            self.phash_index.add(key, dhash(image))
+            self.visual_index.add(key, extract_features(image))
+            processed += 1
+            if processed % batch_size == 0:
+                self.phash_index.save()
+                self.visual_index.save()
+        
+        if processed:
+            self.phash_index.save()
+            self.visual_index.save()
+        return processed
+
+    def export_history(self, dest_path, entries=None, filter_fn=None, target_format=None,
+                       workers=4, progress_callback=None, quality=90):
+        """Потоковый экспорт записей истории и изображений в ZIP или TAR.
+        Возвращает число экспортированных изображений"""
+        with self.lock:
+            selected = list(self.history if entries is None else entries)
+        if filter_fn:
+            selected = [entry for entry in selected if filter_fn(entry)]
+        return export_entries(self, dest_path, selected, target_format, workers, progress_callback, quality)
+
+    def _download_bytes(self, image_url):
+        """Загрузка содержимого файла по URL"""
+        response = requests.get(image_url)
+        response.raise_for_status()
+        return response.content
+
+    def download_image(self, image_url):
+        """Загрузка изображения по URL без сохранения на диск"""
+        return Image.open(BytesIO(self._download_bytes(image_url)))
+
     def get_history(self):
         """Получение истории генераций"""
         return self.history
@@ -72,10 +560,37 @@ class ImageStorage:
     def load_image(self, image_path):
         """Загрузка изображения из файла"""
         try:
-            full_path = os.path.join(IMAGES_DIR, image_path)
-            if os.path.exists(full_path):
-                return Image.open(full_path)
-            return None
+            with self.open_image_file(image_path) as f:
+                if f is None:
+                    return None
+                # Декодируем сразу, чтобы файл был закрыт после выхода из блока
+                with Image.open(f) as image:
+                    image.load()
+                return image
         except Exception as e:
             print(f"Ошибка при загрузке изображения: {str(e)}")
+            return None
+
+    def load_preview(self, image_path, max_size):
+        """Быстрая загрузка уменьшенной копии изображения для предпросмотра"""
+        try:
+            max_width, max_height = max(max_size[0], 1), max(max_size[1], 1)
+            with self.open_image_file(image_path) as f:
+                if f is None:
+                    return None
+                with Image.open(f) as image:
+                    if image.format == 'JPEG':
+                        # JPEG декодируется сразу в масштабе 1/2, 1/4 или 1/8
+                        image.draft(image.mode, (max_width, max_height))
+                        image.load()
+                        return image
+                    
+                    # Для остальных форматов - целочисленное уменьшение без лишних копий
+                    factor = min(image.width // max_width, image.height // max_height)
+                    if factor >= 2:
+                        return image.reduce(factor)
+                    image.load()
+                    return image
+        except Exception as e:
+            print(f"Ошибка при загрузке превью: {str(e)}")
             return None 
\ No newline at end of file
@@ -0,0 +1,409 @@
+"""
+Проверка целостности библиотеки изображений и восстановление истории.
+
+Сверяет записи history.json с файлами на диске (наличие, декодирование,
+контрольная сумма), восстанавливает потерянные записи по файлам и встроенным
+в них метаданным и сообщает о файлах без записей. Прогресс сохраняется
+в контрольной точке, прерванная проверка продолжается с того же места.
+
+Запуск: python -m src.utils.library_scanner [--workers N] [--processes] [--deep] [--full] [--dry-run]
+"""
+import os
+import re
+import json
+import time
+import hashlib
+import argparse
+import logging
+from io import BytesIO
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from PIL import Image
+from .config import IMAGES_DIR
+from .image_storage import (ImageStorage, entry_key, read_embedded_metadata,
+                            EMBEDDED_FIELDS, TIER_FULL, TIER_COMPACT, TIER_EVICTED)
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+CHECKPOINT_FILE = 'scan_state.json'
+# Как часто сохранять контрольную точку, секунд
+CHECKPOINT_INTERVAL = 10
+
+# Результаты проверки записи
+OK = 'ok'
+MISSING = 'missing'
+CORRUPT = 'corrupt'
+CHECKSUM = 'checksum'
+REMOTE = 'remote'
+
+# Производные копии: суффикс имени -> уровень хранения
+DERIVED_SUFFIXES = (('_compact', TIER_COMPACT), ('_thumb', TIER_EVICTED))
+
+TIMESTAMP_PATTERN = re.compile(r'(\d{8}_\d{6})')
+
+def check_file(task):
+    """Чтение файла или участка pack-файла, проверка декодирования и SHA-256.
+    Функция верхнего уровня, чтобы ее можно было выполнять в пуле процессов"""
+    name, path, offset, length, deep, want_metadata = task
+    result = {}
+    try:
+        with open(path, 'rb') as f:
+            if offset:
+                f.seek(offset)
+            data = f.read(length) if length is not None else f.read()
+    except OSError as e:
+        result['error'] = f"чтение: {e}"
+        return name, result
+    if length is not None and len(data) != length:
+        result['error'] = "pack-файл обрезан"
+        return name, result
+
+    result['sha256'] = hashlib.sha256(data).hexdigest()
+    result['bytes'] = len(data)
+    try:
+        with Image.open(BytesIO(data)) as image:
+            result['format'] = (image.format or '').lower()
+            result['dimensions'] = list(image.size)
+            if want_metadata:
+                result['metadata'] = read_embedded_metadata(image)
+            if deep:
+                image.load()
+            elif image.format == 'JPEG':
+                # Уменьшенное декодирование находит обрезанные JPEG почти бесплатно
+                image.draft('RGB', (64, 64))
+                image.load()
+            else:
+                # Для PNG проверяются структура и CRC всех блоков без распаковки
+                image.verify()
+    except Exception as e:
+        result['error'] = f"декодирование: {e}"
+    return name, result
+
+def salvage_history(path):
+    """Записи, которые удается прочитать из поврежденного (обрезанного) файла истории"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        text = f.read()
+    decoder = json.JSONDecoder()
+    entries = []
+    position = text.find('[') + 1
+    while True:
+        position = text.find('{', position)
+        if position < 0:
+            break
+        try:
+            entry, position = decoder.raw_decode(text, position)
+        except ValueError:
+            # Дальше файл обрезан
+            break
+        if isinstance(entry, dict) and 'image_path' in entry:
+            entries.append(entry)
+    return entries
+
+def split_derived(name):
+    """Ключ записи и уровень хранения по имени файла изображения"""
+    stem = os.path.splitext(name)[0]
+    for suffix, tier in DERIVED_SUFFIXES:
+        if stem.endswith(suffix):
+            return stem[:-len(suffix)], tier
+    return stem, TIER_FULL
+
+class LibraryScanner:
+    """Параллельная проверка каталога изображений и восстановление истории"""
+
+    def __init__(self, storage, workers=None, processes=False, deep=False, checkpoint_path=None):
+        self.storage = storage
+        self.workers = workers or min(32, (os.cpu_count() or 1) * (1 if processes else 4))
+        self.processes = processes
+        self.deep = deep
+        self.checkpoint_path = checkpoint_path or os.path.join(IMAGES_DIR, CHECKPOINT_FILE)
+        self.results = {}
+
+    def _load_checkpoint(self):
+        """Результаты прошлых проверок: файл с той же отметкой повторно не читается"""
+        try:
+            with open(self.checkpoint_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            self.results = state.get('files', {})
+        except (OSError, ValueError):
+            self.results = {}
+
+    def _save_checkpoint(self, completed):
+        tmp_file = f'{self.checkpoint_path}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'completed': completed, 'saved': time.time(), 'files': self.results}, f)
+        os.replace(tmp_file, self.checkpoint_path)
+
+    def list_files(self):
+        """Файлы изображений: отдельные и упакованные в архив.
+        Возвращает {имя: (путь, смещение, длина, отметка изменения)}"""
+        files = {}
+        with os.scandir(IMAGES_DIR) as entries:
+            for entry in entries:
+                if entry.name.lower().endswith(IMAGE_EXTENSIONS) and entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files[entry.name] = (entry.path, None, None, [stat.st_size, stat.st_mtime_ns])
+
+        pack = self.storage.pack
+        with pack.lock:
+            pack._refresh_index()
+            index = dict(pack.index)
+        for name, (pack_name, offset, length) in index.items():
+            # Отдельный файл имеет приоритет при чтении
+            if name not in files:
+                files[name] = (os.path.join(pack.directory, pack_name), offset, length, [pack_name, offset, length])
+        return files
+
+    def _check_files(self, files, referenced, progress_callback):
+        """Проверка файлов, изменившихся после прошлой проверки, в пуле потоков или процессов"""
+        tasks = []
+        for name, (path, offset, length, stamp) in files.items():
+            cached = self.results.get(name)
+            want_metadata = name not in referenced
+            if cached and cached.get('stamp') == stamp and (cached.get('deep') or not self.deep) \
+                    and (not want_metadata or 'metadata' in cached or 'error' in cached):
+                continue
+            tasks.append((name, path, offset, length, self.deep, want_metadata))
+
+        # Результаты удаленных файлов больше не нужны
+        for name in set(self.results) - set(files):
+            del self.results[name]
+
+        total = len(tasks)
+        if not total:
+            return 0
+        logger.info(f"Проверка файлов: {total} из {len(files)} (остальные без изменений)")
+        executor_class = ProcessPoolExecutor if self.processes else ThreadPoolExecutor
+        last_saved = time.monotonic()
+        done = 0
+        executor = executor_class(max_workers=self.workers)
+        try:
+            for name, result in executor.map(check_file, tasks, chunksize=64):
+                result['stamp'] = files[name][3]
+                result['deep'] = self.deep
+                self.results[name] = result
+                done += 1
+                if progress_callback and (done % 500 == 0 or done == total):
+                    progress_callback(done, total)
+                if time.monotonic() - last_saved >= CHECKPOINT_INTERVAL:
+                    self._save_checkpoint(completed=False)
+                    last_saved = time.monotonic()
+        finally:
+            # При прерывании проверенное сохраняется, следующий запуск продолжит
+            executor.shutdown(wait=True, cancel_futures=True)
+            self._save_checkpoint(completed=done == total)
+        return total
+
+    def _salvaged_entries(self):
+        """Записи из отложенных поврежденных файлов истории"""
+        salvaged = {}
+        prefix = os.path.basename(self.storage.history_file) + '.damaged.'
+        for name in sorted(os.listdir(IMAGES_DIR)):
+            if name.startswith(prefix):
+                try:
+                    for entry in salvage_history(os.path.join(IMAGES_DIR, name)):
+                        salvaged[entry_key(entry)] = entry
+                except OSError as e:
+                    logger.error(f"Не удалось прочитать {name}: {e}")
+        return salvaged
+
+    def _rebuild_entry(self, key, names, salvaged):
+        """Запись истории по файлам изображения: оригиналу или оставшимся копиям"""
+        by_tier = {tier: name for name, tier in names}
+        candidates = [(tier, by_tier[tier]) for tier in (TIER_FULL, TIER_COMPACT, TIER_EVICTED) if tier in by_tier]
+        old_entry = salvaged.get(key)
+        damaged = None
+        for tier, name in candidates:
+            if 'error' not in self.results[name]:
+                break
+        else:
+            # Неисправный файл возвращаем в историю, только если уцелела его запись
+            if not old_entry:
+                return None
+            tier, name = candidates[0]
+            damaged = CORRUPT
+
+        result = self.results[name]
+        if not damaged and old_entry and old_entry.get('image_path') == name and \
+                old_entry.get('sha256') not in (None, result['sha256']):
+            damaged = CHECKSUM
+        metadata = result.get('metadata', {})
+        if not metadata and tier != TIER_EVICTED and by_tier.get(TIER_EVICTED):
+            metadata = self.results.get(by_tier[TIER_EVICTED], {}).get('metadata', {})
+
+        # Отметка упакованного файла - [pack-файл, смещение, длина], отдельного - [размер, mtime]
+        packed = isinstance(result['stamp'][0], str)
+        match = TIMESTAMP_PATTERN.search(key)
+        if match:
+            timestamp = match.group(1)
+        else:
+            moment = time.time() if packed else result['stamp'][1] / 1e9
+            timestamp = datetime.fromtimestamp(moment).strftime('%Y%m%d_%H%M%S')
+        entry = {
+            'id': key,
+            'timestamp': timestamp,
+            'description': '',
+            'image_path': name,
+            'format': 'jpeg' if result.get('format') in ('jpeg', 'mpo') else result.get('format') or 'png'
+        }
+        entry.update({field: metadata[field] for field in EMBEDDED_FIELDS if field in metadata and field != 'id'})
+        # Уцелевшая часть старой истории точнее встроенных метаданных
+        if old_entry:
+            entry.update({field: value for field, value in old_entry.items()
+                          if field not in ('image_path', 'thumbnail_path', 'tier', 'sha256', 'packed', 'damaged')})
+        entry['recovered'] = True
+        if damaged:
+            entry['damaged'] = damaged
+            if old_entry.get('sha256'):
+                entry['sha256'] = old_entry['sha256']
+        else:
+            entry.update({'file_bytes': result['bytes'], 'sha256': result['sha256']})
+        if tier != TIER_FULL:
+            entry['tier'] = tier
+        if by_tier.get(TIER_EVICTED) and tier != TIER_EVICTED:
+            entry['thumbnail_path'] = by_tier[TIER_EVICTED]
+        if packed:
+            entry['packed'] = True
+        return entry
+
+    def scan(self, repair=True, full=False, progress_callback=None):
+        """Полная проверка библиотеки. repair=False - только отчет без изменения истории.
+        Возвращает отчет: число записей по результатам, восстановленные записи и сироты"""
+        started = time.perf_counter()
+        if not full:
+            self._load_checkpoint()
+
+        self.storage.refresh_if_changed()
+        with self.storage.lock:
+            history = list(self.storage.get_history())
+        referenced = set()
+        for entry in history:
+            for field in ('image_path', 'thumbnail_path'):
+                if entry.get(field):
+                    referenced.add(entry[field])
+
+        files = self.list_files()
+        checked = self._check_files(files, referenced, progress_callback)
+
+        # Сверка записей истории с файлами
+        report = {OK: 0, MISSING: [], CORRUPT: [], CHECKSUM: [], REMOTE: 0}
+        changes = {}
+        for entry in history:
+            key = entry_key(entry)
+            result = self.results.get(entry['image_path'])
+            if result is None:
+                status = REMOTE if self.storage.backend.remote else MISSING
+            elif 'error' in result:
+                status = CORRUPT
+            elif entry.get('sha256') and entry['sha256'] != result['sha256']:
+                status = CHECKSUM
+            else:
+                status = OK
+                if not entry.get('sha256'):
+                    # У старых записей контрольной суммы нет - фиксируем текущую
+                    changes.setdefault(key, {})['sha256'] = result['sha256']
+
+            if status in (OK, REMOTE):
+                report[status] += 1
+                if entry.get('damaged'):
+                    changes.setdefault(key, {})['damaged'] = None
+            else:
+                report[status].append(entry['image_path'])
+                if entry.get('damaged') != status:
+                    changes.setdefault(key, {})['damaged'] = status
+
+        # Файлы без записей: восстановление потерянных записей или сироты
+        known_keys = {entry_key(entry) for entry in history}
+        unreferenced = {}
+        for name in files:
+            if name not in referenced:
+                key, tier = split_derived(name)
+                unreferenced.setdefault(key, []).append((name, tier))
+
+        salvaged = self._salvaged_entries() if unreferenced else {}
+        rebuilt = []
+        orphans = []
+        for key, names in sorted(unreferenced.items()):
+            entry = None if key in known_keys else self._rebuild_entry(key, names, salvaged)
+            if entry is None:
+                orphans.extend(name for name, tier in names)
+            else:
+                rebuilt.append(entry)
+                if entry.get('damaged'):
+                    report[entry['damaged']].append(entry['image_path'])
+                orphans.extend(name for name, tier in names
+                               if name not in (entry['image_path'], entry.get('thumbnail_path')))
+
+        if repair and (changes or rebuilt):
+            def apply(current):
+                for entry in current:
+                    entry_changes = changes.get(entry_key(entry))
+                    if entry_changes:
+                        for field, value in entry_changes.items():
+                            if value is None:
+                                entry.pop(field, None)
+                            else:
+                                entry[field] = value
+                # Восстановленные записи добавляются в конец: индексы, по которым
+                # интерфейс листает историю, не сдвигаются
+                present = {entry_key(entry) for entry in current}
+                added = [entry for entry in rebuilt if entry_key(entry) not in present]
+                current.extend(sorted(added, key=lambda entry: entry['timestamp']))
+            self.storage._update_history(apply)
+
+        report.update({
+            'entries': len(history),
+            'files': len(files),
+            'checked': checked,
+            'rebuilt': [entry['image_path'] for entry in rebuilt],
+            'orphans': sorted(orphans),
+            'repaired': repair,
+            'seconds': round(time.perf_counter() - started, 1)
+        })
+        logger.info(
+            f"Проверка библиотеки: записей {report['entries']}, файлов {report['files']}, "
+            f"проверено {checked}, отсутствуют {len(report[MISSING])}, повреждены {len(report[CORRUPT])}, "
+            f"не совпала сумма {len(report[CHECKSUM])}, восстановлено {len(rebuilt)}, сирот {len(orphans)}"
+        )
+        return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка и восстановление библиотеки изображений")
+    parser.add_argument('--workers', type=int, default=None, help="Число потоков или процессов")
+    parser.add_argument('--processes', action='store_true', help="Проверять в пуле процессов")
+    parser.add_argument('--deep', action='store_true', help="Полностью декодировать каждое изображение")
+    parser.add_argument('--full', action='store_true', help="Игнорировать результаты прошлых проверок")
+    parser.add_argument('--dry-run', action='store_true', help="Только отчет, без изменения истории")
+    parser.add_argument('--json', action='store_true', help="Вывести отчет в JSON")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    scanner = LibraryScanner(ImageStorage(), args.workers, args.processes, args.deep)
+    try:
+        report = scanner.scan(
+            repair=not args.dry_run,
+            full=args.full,
+            progress_callback=lambda done, total: print(f"  {done}/{total}", end='\r')
+        )
+    except KeyboardInterrupt:
+        print("\nПроверка прервана, следующий запуск продолжит с контрольной точки")
+        return
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"\nЗаписей: {report['entries']}, в порядке: {report[OK]}, файлов: {report['files']}, "
+          f"проверено: {report['checked']} за {report['seconds']} с")
+    for title, key in (("Нет файла", MISSING), ("Не декодируется", CORRUPT),
+                       ("Не совпала контрольная сумма", CHECKSUM),
+                       ("Восстановлены записи", 'rebuilt'), ("Файлы без записей", 'orphans')):
+        names = report[key]
+        if names:
+            print(f"{title} ({len(names)}):")
+            for name in names[:20]:
+                print(f"  {name}")
+            if len(names) > 20:
+                print(f"  ... и еще {len(names) - 20}")
+
+if __name__ == "__main__":
+    main()
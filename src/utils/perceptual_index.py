@@ -0,0 +1,43 @@
+import numpy as np
+from PIL import Image
+from .vector_index import PersistentIndex
+
+# Число единичных бит для каждого значения байта (для numpy без bitwise_count)
+POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+def dhash(image, hash_size=8):
+    """Разностный перцептивный хеш: 64 бита для hash_size=8"""
+    small = image.convert('L').resize((hash_size + 1, hash_size), Image.Resampling.BILINEAR)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int(np.packbits(bits).view('>u8')[0])
+
+def hamming_distances(hashes, value):
+    """Векторизованное расстояние Хэмминга от value до каждого хеша массива"""
+    xored = np.bitwise_xor(hashes, np.uint64(value))
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(xored)
+    return POPCOUNT_TABLE[xored.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+class PerceptualIndex(PersistentIndex):
+    """Индекс перцептивных хешей для поиска почти одинаковых изображений"""
+
+    row_shape = ()
+    dtype = np.uint64
+
+    def __init__(self, directory, save_interval=30):
+        super().__init__(directory, 'phash_index.npy', 'phash_keys.json', 'phash_index.lock', save_interval)
+
+    def get(self, key):
+        position = self.positions.get(key)
+        return None if position is None else int(self.vectors[position])
+
+    def query(self, value, max_distance=10, limit=20):
+        """Поиск хешей на расстоянии Хэмминга не больше max_distance.
+        Возвращает список пар (ключ, расстояние), ближайшие первыми"""
+        with self.lock:
+            count = len(self.keys)
+            distances = hamming_distances(self.vectors[:count], value)
+            matches = np.nonzero(distances <= max_distance)[0]
+            order = matches[np.argsort(distances[matches], kind='stable')][:limit]
+            return [(self.keys[i], int(distances[i])) for i in order]
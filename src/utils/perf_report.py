@@ -0,0 +1,126 @@
+"""
+Отчет о производительности генераций по данным истории.
+
+Запуск: python -m src.utils.perf_report [--group style,model,day] [--days N] [--images-dir DIR]
+"""
+import os
+import json
+import argparse
+from datetime import datetime, timedelta
+from collections import defaultdict
+
+from .config import IMAGES_DIR
+
+# Поля группировки и способ получения значения из записи истории
+GROUP_FIELDS = {
+    'style': lambda entry: entry.get('style', '-'),
+    'model': lambda entry: entry.get('model', '-'),
+    'size': lambda entry: entry.get('size', '-'),
+    'day': lambda entry: entry['timestamp'][:8]
+}
+
+def percentile(values, p):
+    """Перцентиль с линейной интерполяцией"""
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def parse_timestamp(entry):
+    return datetime.strptime(entry['timestamp'][:15], '%Y%m%d_%H%M%S')
+
+def build_report(history, group_by=('style', 'model', 'day'), since=None):
+    """Агрегация задержек и пропускной способности по группам записей"""
+    groups = defaultdict(list)
+    for entry in history:
+        # Записи, созданные до появления метрик, пропускаем
+        if 'latency' not in entry:
+            continue
+        if since and parse_timestamp(entry) < since:
+            continue
+        key = tuple(GROUP_FIELDS[field](entry) for field in group_by)
+        groups[key].append(entry)
+
+    rows = []
+    for key, entries in sorted(groups.items()):
+        latencies = [entry['latency'] for entry in entries]
+        downloads = [entry['download_time'] for entry in entries if 'download_time' in entry]
+        encodes = [entry['encode_time'] for entry in entries if 'encode_time' in entry]
+        # Ожидание ограничителя частоты не входит в latency и показывается отдельно
+        waits = [entry['limiter_wait'] for entry in entries if 'limiter_wait' in entry]
+        timestamps = [parse_timestamp(entry) for entry in entries]
+        span_hours = (max(timestamps) - min(timestamps)).total_seconds() / 3600
+        total_bytes = sum(entry.get('bytes', 0) for entry in entries)
+
+        rows.append({
+            'group': dict(zip(group_by, key)),
+            'count': len(entries),
+            'latency_p50': percentile(latencies, 50),
+            'latency_p90': percentile(latencies, 90),
+            'latency_p99': percentile(latencies, 99),
+            'download_p50': percentile(downloads, 50),
+            'encode_p50': percentile(encodes, 50),
+            'limiter_wait_p90': percentile(waits, 90),
+            'avg_bytes': total_bytes / len(entries),
+            # Изображений в час на интервале активности группы
+            'per_hour': len(entries) / span_hours if span_hours > 0 else None
+        })
+    return rows
+
+def format_report(rows, group_by):
+    """Форматирование отчета в виде текстовой таблицы"""
+    def fmt(value, digits=2):
+        return '-' if value is None else f'{value:.{digits}f}'
+
+    headers = list(group_by) + ['n', 'p50, с', 'p90, с', 'p99, с', 'загр. p50', 'кодир. p50', 'очередь p90', 'КБ', 'в час']
+    lines = [headers]
+    for row in rows:
+        lines.append([str(row['group'][field]) for field in group_by] + [
+            str(row['count']),
+            fmt(row['latency_p50']),
+            fmt(row['latency_p90']),
+            fmt(row['latency_p99']),
+            fmt(row['download_p50']),
+            fmt(row['encode_p50'], 3),
+            fmt(row['limiter_wait_p90']),
+            fmt(row['avg_bytes'] / 1024, 0),
+            fmt(row['per_hour'], 1)
+        ])
+
+    widths = [max(len(line[i]) for line in lines) for i in range(len(headers))]
+    return '\n'.join('  '.join(cell.ljust(width) for cell, width in zip(line, widths)) for line in lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Отчет о производительности генераций")
+    parser.add_argument('--group', default='style,model,day',
+                        help=f"поля группировки через запятую: {', '.join(GROUP_FIELDS)}")
+    parser.add_argument('--days', type=int, help="только последние N дней")
+    parser.add_argument('--json', action='store_true', help="вывод в формате JSON")
+    parser.add_argument('--images-dir', default=IMAGES_DIR, help="каталог изображений с history.json")
+    args = parser.parse_args()
+
+    group_by = tuple(field.strip() for field in args.group.split(',') if field.strip())
+    unknown = [field for field in group_by if field not in GROUP_FIELDS]
+    if unknown:
+        parser.error(f"неизвестные поля группировки: {', '.join(unknown)}")
+
+    history_file = os.path.join(args.images_dir, 'history.json')
+    history = []
+    if os.path.exists(history_file):
+        with open(history_file, 'r', encoding='utf-8') as f:
+            history = json.load(f)
+
+    since = datetime.now() - timedelta(days=args.days) if args.days else None
+    rows = build_report(history, group_by, since)
+    if args.json:
+        print(json.dumps(rows, ensure_ascii=False, indent=2))
+    elif rows:
+        print(format_report(rows, group_by))
+    else:
+        print("Нет записей с метриками производительности")
+
+if __name__ == "__main__":
+    main()
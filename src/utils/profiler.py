@@ -0,0 +1,193 @@
+import os
+import io
+import json
+import time
+import atexit
+import pstats
+import cProfile
+import logging
+import threading
+import functools
+from .config import PROFILE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class SessionProfiler:
+    """Профилирование горячих путей приложения в течение сеанса.
+
+    Обернутые функции выполняются под cProfile, профили накапливаются
+    по имени функции и при остановке записываются в формате pstats
+    (открываются snakeviz, gprof2dot, python -m pstats). Дополнительно
+    замеряются все обработчики Tk и отмечаются блокирующие главный цикл
+    дольше порога."""
+
+    def __init__(self, directory=None, slow_callback_ms=None):
+        self.directory = directory or PROFILE_CONFIG['dir']
+        self.slow_callback_ms = slow_callback_ms or PROFILE_CONFIG['slow_callback_ms']
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.session = None
+        self.stats = {}
+        self.timings = {}
+        self.slow_callbacks = []
+        self.original_tk_call = None
+        self.local = threading.local()
+        atexit.register(self.stop)
+
+    def start(self):
+        """Начало сеанса профилирования"""
+        with self.lock:
+            if self.enabled:
+                return
+            self.session = time.strftime("%Y%m%d_%H%M%S")
+            self.stats = {}
+            self.timings = {}
+            self.slow_callbacks = []
+            self.enabled = True
+        self._install_tk_hook()
+        logger.info("Профилирование включено")
+
+    def stop(self):
+        """Завершение сеанса и запись профилей. Возвращает путь к отчету или None"""
+        with self.lock:
+            if not self.enabled:
+                return None
+            self.enabled = False
+        self._remove_tk_hook()
+        return self.save()
+
+    def toggle(self):
+        if self.enabled:
+            return self.stop()
+        self.start()
+        return None
+
+    def wrap(self, func, name=None):
+        """Обертка функции: при включенном профилировании вызов идет под cProfile"""
+        name = name or getattr(func, '__qualname__', repr(func))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+            # Вложенный вызов уже попадает в профиль внешнего - только замер времени
+            profile = None if getattr(self.local, 'active', False) else cProfile.Profile()
+            started = time.perf_counter()
+            if profile is not None:
+                try:
+                    profile.enable()
+                    self.local.active = True
+                except ValueError:
+                    # Профилировщик уже запущен другим инструментом
+                    profile = None
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if profile is not None:
+                    profile.disable()
+                    self.local.active = False
+                self._record(name, time.perf_counter() - started, profile)
+        return wrapper
+
+    def wrap_methods(self, obj, *names):
+        """Замена методов экземпляра профилируемыми обертками"""
+        for name in names:
+            setattr(obj, name, self.wrap(getattr(obj, name), f"{type(obj).__name__}.{name}"))
+
+    def _record(self, name, elapsed, profile):
+        with self.lock:
+            if self.session is None:
+                return
+            count, total, longest = self.timings.get(name, (0, 0.0, 0.0))
+            self.timings[name] = (count + 1, total + elapsed, max(longest, elapsed))
+            if profile is None:
+                return
+            stats = self.stats.get(name)
+            if stats is None:
+                self.stats[name] = pstats.Stats(profile)
+            else:
+                stats.add(profile)
+
+    def _install_tk_hook(self):
+        """Замер всех обработчиков Tk: команд кнопок, событий и after"""
+        if self.original_tk_call is not None:
+            return
+        try:
+            import tkinter
+        except ImportError:
+            return
+        original = self.original_tk_call = tkinter.CallWrapper.__call__
+        profiler = self
+
+        def timed_call(wrapper, *args):
+            started = time.perf_counter()
+            try:
+                return original(wrapper, *args)
+            finally:
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                if elapsed_ms >= profiler.slow_callback_ms:
+                    name = getattr(wrapper.func, '__qualname__', repr(wrapper.func))
+                    if name.endswith('<locals>.callit'):
+                        # Обертка after сохраняет только имя вызываемой функции
+                        name = f"after: {wrapper.func.__name__}"
+                    profiler.slow_callbacks.append((time.time(), name, round(elapsed_ms, 1)))
+                    logger.warning(f"Обработчик Tk {name} блокировал интерфейс {elapsed_ms:.0f} мс")
+
+        tkinter.CallWrapper.__call__ = timed_call
+
+    def _remove_tk_hook(self):
+        if self.original_tk_call is not None:
+            import tkinter
+            tkinter.CallWrapper.__call__ = self.original_tk_call
+            self.original_tk_call = None
+
+    def save(self):
+        """Запись профилей сеанса: .prof на каждую функцию, общий и текстовый отчет"""
+        with self.lock:
+            stats = dict(self.stats)
+            timings = dict(self.timings)
+            slow_callbacks = list(self.slow_callbacks)
+            session = self.session
+        if session is None or not (stats or timings or slow_callbacks):
+            return None
+
+        directory = os.path.join(self.directory, session)
+        os.makedirs(directory, exist_ok=True)
+        combined = None
+        for name, function_stats in stats.items():
+            function_stats.dump_stats(os.path.join(directory, f"{name}.prof"))
+            if combined is None:
+                combined = pstats.Stats(os.path.join(directory, f"{name}.prof"))
+            else:
+                combined.add(function_stats)
+        if combined is not None:
+            combined.dump_stats(os.path.join(directory, "session.prof"))
+
+        report = io.StringIO()
+        report.write(f"Сеанс профилирования {session}\n\nВремя вызовов:\n")
+        for name, (count, total, longest) in sorted(timings.items(), key=lambda item: -item[1][1]):
+            report.write(f"  {name}: {count} вызовов, всего {total:.3f} с, "
+                         f"в среднем {total / count:.3f} с, максимум {longest:.3f} с\n")
+        report.write(f"\nОбработчики Tk дольше {self.slow_callback_ms} мс: {len(slow_callbacks)}\n")
+        for moment, name, elapsed_ms in slow_callbacks:
+            report.write(f"  {time.strftime('%H:%M:%S', time.localtime(moment))} {name}: {elapsed_ms} мс\n")
+        if combined is not None:
+            report.write("\nСамые затратные функции (по накопленному времени):\n")
+            combined.stream = report
+            combined.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(30)
+
+        report_path = os.path.join(directory, "report.txt")
+        with open(report_path, 'w', encoding='utf-8') as f:
+            f.write(report.getvalue())
+        with open(os.path.join(directory, "slow_callbacks.json"), 'w', encoding='utf-8') as f:
+            json.dump(
+                [{'time': moment, 'callback': name, 'ms': elapsed_ms} for moment, name, elapsed_ms in slow_callbacks],
+                f, ensure_ascii=False, indent=2
+            )
+        logger.info(f"Профили сеанса сохранены в {directory}")
+        return report_path
+
+# Общий профилировщик процесса; включается NEYROTG_PROFILE=1 или из интерфейса
+profiler = SessionProfiler()
+if PROFILE_CONFIG['enabled']:
+    profiler.start()
@@ -0,0 +1,104 @@
+import os
+import threading
+import logging
+from .config import IMAGES_DIR, STORAGE_CONFIG
+from .image_storage import TIER_FULL, TIER_COMPACT
+
+logger = logging.getLogger(__name__)
+
+class RetentionManager:
+    """Фоновое соблюдение дисковой квоты каталога изображений.
+    Квота 0 означает, что очистка выключена"""
+
+    def __init__(self, storage, budget_bytes=None):
+        self.storage = storage
+        if budget_bytes is None:
+            budget_bytes = STORAGE_CONFIG['disk_budget_mb'] * 1024 * 1024
+        self.budget_bytes = budget_bytes
+        self.wakeup = threading.Event()
+        self.thread = None
+
+    def directory_usage(self):
+        """Суммарный размер отдельных файлов в каталоге изображений и pack-файлов архива"""
+        total = self.storage.pack.total_bytes()
+        with os.scandir(IMAGES_DIR) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    total += entry.stat(follow_symlinks=False).st_size
+        return total
+
+    def run_once(self, max_items=None):
+        """Один проход очистки: сначала пережимаем старые оригиналы,
+        затем удаляем старые копии. Возвращает число обработанных записей"""
+        if not self.budget_bytes:
+            return 0
+        max_items = max_items or STORAGE_CONFIG['retention_batch']
+        usage = self.directory_usage()
+        if usage <= self.budget_bytes:
+            return 0
+        
+        with self.storage.lock:
+            history = list(self.storage.get_history())
+        # Самые свежие изображения не трогаем
+        candidates = history[:max(len(history) - STORAGE_CONFIG['keep_recent'], 0)]
+        
+        processed = 0
+        for tier, action in ((TIER_FULL, self.storage.compact_entry),
+                             (TIER_COMPACT, self.storage.evict_entry)):
+            for entry in candidates:
+                if usage <= self.budget_bytes or processed >= max_items:
+                    break
+                if entry.get('tier', TIER_FULL) != tier:
+                    continue
+                try:
+                    freed = action(entry)
+                    # Записи без файла на диске остаются на прежнем уровне
+                    if freed is not None:
+                        usage -= freed
+                        processed += 1
+                except Exception as e:
+                    logger.error(f"Ошибка при очистке {entry.get('image_path')}: {e}")
+        
+        if processed:
+            # Место упакованных изображений освобождается перезаписью pack-файлов
+            freed = self.storage.pack.repack()
+            if freed:
+                logger.info(f"Перепаковка архива: освобождено {freed // (1024 * 1024)} МБ")
+            logger.info(f"Очистка хранилища: обработано {processed}, занято {usage // (1024 * 1024)} МБ")
+        return processed
+
+    def trigger(self):
+        """Запросить внеочередной проход очистки"""
+        self.wakeup.set()
+
+    def start(self):
+        """Запуск фоновой очистки"""
+        if self.thread:
+            return
+        if not self.budget_bytes and not STORAGE_CONFIG['archive_mode']:
+            return
+        if self.budget_bytes:
+            logger.warning(
+                f"Дисковая квота {self.budget_bytes // (1024 * 1024)} МБ: при ее превышении старые "
+                f"оригиналы будут пережаты в JPEG, а затем удалены (NEYROTG_DISK_BUDGET_MB=0 - выключить)"
+            )
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                # Пока квота превышена, продолжаем небольшими порциями
+                while self.run_once():
+                    pass
+            except Exception as e:
+                logger.error(f"Ошибка фоновой очистки: {e}")
+            if STORAGE_CONFIG['archive_mode']:
+                try:
+                    archived = self.storage.archive_old_images()
+                    if archived:
+                        logger.info(f"Упаковано в архив файлов: {archived}")
+                except Exception as e:
+                    logger.error(f"Ошибка упаковки архива: {e}")
+            self.wakeup.wait(STORAGE_CONFIG['retention_interval'])
+            self.wakeup.clear()
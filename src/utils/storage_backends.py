@@ -0,0 +1,172 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from .config import STORAGE_BACKEND_CONFIG
+
+logger = logging.getLogger(__name__)
+
+class StorageBackend:
+    """Интерфейс хранилища изображений, общего для нескольких рабочих мест"""
+
+    remote = False
+
+    def upload(self, name, path):
+        """Асинхронная загрузка файла в хранилище, возвращает Future"""
+        raise NotImplementedError
+
+    def download(self, name, dest_path):
+        """Скачивание файла из хранилища. Возвращает True, если файл найден"""
+        raise NotImplementedError
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def delete(self, name):
+        raise NotImplementedError
+
+class LocalStorageBackend(StorageBackend):
+    """Локальный каталог: файлы уже лежат в IMAGES_DIR, передавать нечего"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def upload(self, name, path):
+        future = Future()
+        future.set_result(None)
+        return future
+
+    def download(self, name, dest_path):
+        return False
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.root, name))
+
+    def delete(self, name):
+        pass
+
+class S3StorageBackend(StorageBackend):
+    """S3-совместимое хранилище (AWS S3, MinIO и т.п.)"""
+
+    remote = True
+
+    def __init__(self, bucket, endpoint_url=None, prefix='', max_workers=8):
+        try:
+            import boto3
+            from boto3.s3.transfer import TransferConfig
+            from botocore.exceptions import ClientError
+        except ImportError:
+            raise ImportError("Для хранилища S3 установите boto3: pip install boto3")
+
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+        self.client_error = ClientError
+        # Клиент boto3 потокобезопасен и переиспользуется всеми передачами
+        self.client = boto3.client('s3', endpoint_url=endpoint_url or None)
+        # Большие файлы загружаются частями параллельно
+        self.transfer_config = TransferConfig(
+            multipart_threshold=8 * 1024 * 1024,
+            multipart_chunksize=8 * 1024 * 1024,
+            max_concurrency=4
+        )
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="s3")
+
+    def _key(self, name):
+        return f'{self.prefix}/{name}' if self.prefix else name
+
+    def upload(self, name, path):
+        def do_upload():
+            self.client.upload_file(path, self.bucket, self._key(name), Config=self.transfer_config)
+        def log_error(future):
+            if future.exception():
+                logger.error(f"Ошибка загрузки {name} в S3: {future.exception()}")
+        
+        future = self.executor.submit(do_upload)
+        future.add_done_callback(log_error)
+        return future
+
+    def download(self, name, dest_path):
+        tmp_path = f'{dest_path}.{os.getpid()}.{threading.get_ident()}.part'
+        try:
+            self.client.download_file(self.bucket, self._key(name), tmp_path, Config=self.transfer_config)
+        except self.client_error as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                return False
+            raise
+        os.replace(tmp_path, dest_path)
+        return True
+
+    def exists(self, name):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self._key(name))
+            return True
+        except self.client_error:
+            return False
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(name))
+
+class ReadThroughCache:
+    """Локальный LRU-кеш недавно просмотренных изображений из удаленного хранилища"""
+
+    def __init__(self, backend, directory, max_bytes):
+        self.backend = backend
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        os.makedirs(directory, exist_ok=True)
+
+        # Восстанавливаем состояние кеша, самые старые файлы - первыми
+        files = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and not entry.name.endswith('.part'):
+                stat = entry.stat()
+                files.append((stat.st_atime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self.entries[name] = size
+            self.total_bytes += size
+
+    def get(self, name):
+        """Путь к локальной копии файла, при необходимости скачивает его"""
+        path = os.path.join(self.directory, name)
+        with self.lock:
+            if name in self.entries and os.path.exists(path):
+                self.entries.move_to_end(name)
+                return path
+
+        if not self.backend.download(name, path):
+            return None
+
+        with self.lock:
+            size = os.path.getsize(path)
+            self.total_bytes += size - self.entries.pop(name, 0)
+            self.entries[name] = size
+            self._evict()
+        return path
+
+    def _evict(self):
+        """Удаление давно не использованных файлов сверх лимита"""
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            name, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+def create_backend(root):
+    """Создание хранилища по настройкам"""
+    kind = STORAGE_BACKEND_CONFIG['backend']
+    if kind == 's3':
+        return S3StorageBackend(
+            bucket=STORAGE_BACKEND_CONFIG['s3_bucket'],
+            endpoint_url=STORAGE_BACKEND_CONFIG['s3_endpoint_url'],
+            prefix=STORAGE_BACKEND_CONFIG['s3_prefix'],
+            max_workers=STORAGE_BACKEND_CONFIG['transfer_workers']
+        )
+    if kind != 'local':
+        raise ValueError(f"Неизвестное хранилище: {kind}")
+    return LocalStorageBackend(root)
@@ -0,0 +1,123 @@
+import os
+import json
+import time
+import atexit
+import threading
+import numpy as np
+from .file_lock import FileLock
+
+class PersistentIndex:
+    """Общая основа индексов ключ -> вектор: хранение в .npy и списке ключей,
+    межпроцессная блокировка, слияние с записями других процессов и
+    отложенная запись. Подкласс задает форму и тип векторов и поиск"""
+
+    # Форма одного вектора, тип в памяти и тип на диске (None - как в памяти)
+    row_shape = ()
+    dtype = np.float32
+    disk_dtype = None
+
+    def __init__(self, directory, vectors_name, keys_name, lock_name, save_interval=30):
+        self.vectors_file = os.path.join(directory, vectors_name)
+        self.keys_file = os.path.join(directory, keys_name)
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        # Индекс дополняют UI, API сервер и бот - запись сериализуется lock-файлом
+        self.file_lock = FileLock(os.path.join(directory, lock_name))
+        self.dirty = False
+        self.last_save = time.monotonic()
+        self._load()
+        atexit.register(self.save_if_dirty)
+
+    def _disk_signature(self):
+        try:
+            stat = os.stat(self.keys_file)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def _read_disk(self):
+        """Ключи и векторы из файлов индекса (вызывается под file_lock)"""
+        if not (os.path.exists(self.vectors_file) and os.path.exists(self.keys_file)):
+            return [], None
+        with open(self.keys_file, 'r', encoding='utf-8') as f:
+            keys = json.load(f)
+        stored = np.load(self.vectors_file)
+        # Файл другой размерности (старый формат) считаем пустым
+        if stored.shape[1:] != tuple(self.row_shape):
+            return [], None
+        count = min(len(keys), len(stored))
+        return keys[:count], stored[:count]
+
+    def _allocate(self, rows):
+        return np.zeros((rows,) + tuple(self.row_shape), dtype=self.dtype)
+
+    def _load(self):
+        """Загрузка индекса с диска"""
+        with self.file_lock:
+            keys, stored = self._read_disk()
+            self.disk_signature = self._disk_signature()
+        count = len(keys)
+        self.keys = keys
+        self.vectors = self._allocate(max(count * 2, 1024))
+        if count:
+            self.vectors[:count] = stored
+        self.positions = {key: i for i, key in enumerate(self.keys)}
+
+    def save(self):
+        """Запись индекса: под межпроцессной блокировкой дополняем его векторами,
+        сохраненными другими процессами, и атомарно заменяем файлы"""
+        with self.file_lock:
+            if self._disk_signature() != self.disk_signature:
+                keys, stored = self._read_disk()
+                for i, key in enumerate(keys):
+                    if key not in self.positions:
+                        self.add(key, stored[i])
+            with self.lock:
+                count = len(self.keys)
+                vectors = self.vectors[:count].astype(self.disk_dtype or self.dtype)
+                keys = list(self.keys)
+                self.dirty = False
+                self.last_save = time.monotonic()
+            tmp_vectors = f'{self.vectors_file}.{os.getpid()}.{threading.get_ident()}.tmp.npy'
+            tmp_keys = f'{self.keys_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+            np.save(tmp_vectors, vectors)
+            with open(tmp_keys, 'w', encoding='utf-8') as f:
+                json.dump(keys, f)
+            os.replace(tmp_vectors, self.vectors_file)
+            os.replace(tmp_keys, self.keys_file)
+            self.disk_signature = self._disk_signature()
+
+    def save_if_dirty(self):
+        if self.dirty:
+            self.save()
+
+    def maybe_save(self):
+        """Запись на диск не чаще, чем раз в save_interval секунд"""
+        if self.dirty and time.monotonic() - self.last_save >= self.save_interval:
+            self.save()
+
+    def __contains__(self, key):
+        return key in self.positions
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, vector):
+        """Добавление или замена вектора изображения"""
+        with self.lock:
+            position = self.positions.get(key)
+            if position is None:
+                position = len(self.keys)
+                if position >= len(self.vectors):
+                    # Массив растет удвоением, чтобы добавление было амортизированно O(1)
+                    grown = self._allocate(len(self.vectors) * 2)
+                    grown[:position] = self.vectors[:position]
+                    self.vectors = grown
+                self.keys.append(key)
+                self.positions[key] = position
+            self.vectors[position] = vector
+            self.dirty = True
+
+    def get(self, key):
+        position = self.positions.get(key)
+        return None if position is None else self.vectors[position].copy()
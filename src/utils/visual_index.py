@@ -0,0 +1,56 @@
+import numpy as np
+from PIL import Image
+from .vector_index import PersistentIndex
+
+# Размерность признаков: цветовая гистограмма 4x4x4 и миниатюра 8x8 в оттенках серого
+HISTOGRAM_BINS = 4
+THUMBNAIL_SIZE = 8
+FEATURE_SIZE = HISTOGRAM_BINS ** 3 + THUMBNAIL_SIZE ** 2
+
+def extract_features(image):
+    """Вектор визуальных признаков изображения, нормированный для косинусной близости"""
+    small = image.convert('RGB').resize((64, 64), Image.Resampling.BILINEAR)
+    pixels = np.asarray(small, dtype=np.uint8).reshape(-1, 3)
+
+    # Цветовая гистограмма; корень уменьшает вес доминирующих цветов
+    bins = (pixels // (256 // HISTOGRAM_BINS)).astype(np.int32)
+    codes = (bins[:, 0] * HISTOGRAM_BINS + bins[:, 1]) * HISTOGRAM_BINS + bins[:, 2]
+    histogram = np.bincount(codes, minlength=HISTOGRAM_BINS ** 3).astype(np.float32)
+    histogram = np.sqrt(histogram / histogram.sum())
+
+    # Уменьшенная копия передает композицию: где светлые и темные области
+    layout = np.asarray(
+        small.convert('L').resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.BILINEAR),
+        dtype=np.float32
+    ).flatten()
+    layout -= layout.mean()
+    layout_norm = np.linalg.norm(layout)
+    if layout_norm > 0:
+        layout /= layout_norm
+
+    features = np.concatenate([histogram, layout])
+    return features / np.linalg.norm(features)
+
+class VisualIndex(PersistentIndex):
+    """Индекс визуальных признаков для поиска похожих изображений"""
+
+    row_shape = (FEATURE_SIZE,)
+    dtype = np.float32
+    # На диске признаки хранятся в float16 - вдвое компактнее
+    disk_dtype = np.float16
+
+    def __init__(self, directory, save_interval=30):
+        super().__init__(directory, 'visual_features.npy', 'visual_keys.json', 'visual_index.lock', save_interval)
+
+    def query(self, features, k=20):
+        """Top-k по косинусной близости. Возвращает список пар (ключ, близость)"""
+        with self.lock:
+            count = len(self.keys)
+            if count == 0:
+                return []
+            # Векторы нормированы, поэтому скалярное произведение - это косинус
+            scores = self.vectors[:count] @ features.astype(np.float32)
+            k = min(k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self.keys[i], float(scores[i])) for i in top]
@@ -0,0 +1,125 @@
+"""
+Нагрузочный тест Telegram бота против локальных заглушек Bot API и OpenAI API.
+
+Запуск: python tools/bot_load_test.py [--chats 300] [--messages 2] [--latency 0.5]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from aiohttp import web
+
+from load_test import start_stub, percentile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class FakeBotApi:
+    """Заглушка Bot API: отдает сообщения через getUpdates и принимает ответы бота"""
+
+    def __init__(self):
+        self.updates = asyncio.Queue()
+        self.next_update_id = 1
+        self.sent_at = {}
+        self.latencies = []
+        self.messages = 0
+        self.photo_bytes = 0
+        self.done = asyncio.Event()
+        self.expected = 0
+
+    def push_message(self, chat_id, text):
+        self.updates.put_nowait({
+            'update_id': self.next_update_id,
+            'message': {'message_id': self.next_update_id, 'chat': {'id': chat_id}, 'text': text}
+        })
+        self.sent_at.setdefault(chat_id, []).append(time.perf_counter())
+        self.next_update_id += 1
+
+    def reply_received(self, chat_id):
+        self.latencies.append(time.perf_counter() - self.sent_at[chat_id].pop(0))
+        if len(self.latencies) >= self.expected:
+            self.done.set()
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        if method == 'getUpdates':
+            payload = await request.json()
+            batch = []
+            try:
+                batch.append(await asyncio.wait_for(self.updates.get(), payload.get('timeout', 0)))
+            except asyncio.TimeoutError:
+                pass
+            while not self.updates.empty() and len(batch) < 100:
+                batch.append(self.updates.get_nowait())
+            return web.json_response({'ok': True, 'result': batch})
+        if method == 'sendPhoto':
+            fields = {}
+            reader = await request.multipart()
+            async for part in reader:
+                data = await part.read()
+                fields[part.name] = data
+            self.photo_bytes += len(fields.get('photo', b''))
+            self.reply_received(int(fields['chat_id']))
+            return web.json_response({'ok': True, 'result': {}})
+        if method == 'sendMessage':
+            payload = await request.json()
+            self.messages += 1
+            self.reply_received(payload['chat_id'])
+        return web.json_response({'ok': True, 'result': True})
+
+async def run(args):
+    from src.bot.telegram_bot import TelegramBot
+
+    api = FakeBotApi()
+    app = web.Application()
+    app.router.add_post('/bot{token}/{method}', api.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+
+    bot = TelegramBot(token='test', api_base=f"http://127.0.0.1:{port}")
+    bot_task = asyncio.create_task(bot.run())
+
+    api.expected = args.chats * args.messages
+    started = time.perf_counter()
+    for i in range(args.messages):
+        for chat_id in range(1, args.chats + 1):
+            api.push_message(chat_id, f"load test {chat_id % 50} {i}")
+    await asyncio.wait_for(api.done.wait(), timeout=args.timeout)
+    elapsed = time.perf_counter() - started
+
+    print(f"Чатов: {args.chats}, ответов: {len(api.latencies)} за {elapsed:.1f} с "
+          f"({len(api.latencies) / elapsed:.1f} в секунду)")
+    print(f"  Текстовых ответов (ошибки, перегрузка): {api.messages}")
+    print(f"  Получено байт изображений: {api.photo_bytes}")
+    print(f"  Задержка: p50 {percentile(api.latencies, 50):.2f} с, "
+          f"p95 {percentile(api.latencies, 95):.2f} с, p99 {percentile(api.latencies, 99):.2f} с")
+
+    bot_task.cancel()
+    await asyncio.gather(bot_task, return_exceptions=True)
+    await runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест Telegram бота")
+    parser.add_argument('--chats', type=int, default=300, help="одновременных чатов")
+    parser.add_argument('--messages', type=int, default=2, help="сообщений от каждого чата")
+    parser.add_argument('--latency', type=float, default=0.5, help="задержка заглушки OpenAI API, с")
+    parser.add_argument('--timeout', type=float, default=600, help="предельное время теста, с")
+    args = parser.parse_args()
+
+    stub = start_stub(args.latency)
+    # Настройки должны быть заданы до импорта модулей приложения
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-loadtest')
+    os.environ['OPENAI_API_BASE'] = f"http://127.0.0.1:{stub.server_address[1]}/v1"
+    os.environ['NEYROTG_IMAGES_DIR'] = tempfile.mkdtemp(prefix="neyrotg_bot_load_")
+    os.environ['NEYROTG_IMAGES_RPM'] = '100000'
+    os.environ['NEYROTG_CHAT_RPM'] = '100000'
+
+    asyncio.run(run(args))
+    stub.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+Нагрузочный тест HTTP API сервера против локальной заглушки OpenAI API.
+
+Запуск: python tools/load_test.py [--clients 50] [--requests 500] [--workers 8] [--queue 32]
+                                  [--tenants 10] [--batch-share 0.5]
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class StubOpenAIHandler(BaseHTTPRequestHandler):
+    """Заглушка OpenAI API с настраиваемой задержкой ответа"""
+
+    protocol_version = "HTTP/1.1"
+    latency = 0.5
+    image_bytes = b""
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        payload = json.loads(self.rfile.read(length) or b"{}")
+        time.sleep(self.latency)
+        if self.path.endswith("/images/generations"):
+            host, port = self.server.server_address[:2]
+            body = {'data': [{
+                'url': f"http://{host}:{port}/files/image.png",
+                'revised_prompt': payload.get('prompt', '')[:100]
+            }]}
+        elif self.path.endswith("/chat/completions"):
+            body = {'choices': [{'message': {'content': "stub completion"}}]}
+        else:
+            self._send(404, b"{}")
+            return
+        self._send(200, json.dumps(body).encode('utf-8'))
+
+    def do_GET(self):
+        if self.path.startswith("/files/"):
+            self._send(200, self.image_bytes, "image/png")
+        else:
+            self._send(404, b"{}")
+
+def start_stub(latency):
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (1024, 1024), (40, 120, 200)).save(buffer, 'PNG')
+    handler = type("Handler", (StubOpenAIHandler,), {'latency': latency, 'image_bytes': buffer.getvalue()})
+    stub = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    stub.daemon_threads = True
+    threading.Thread(target=stub.serve_forever, daemon=True).start()
+    return stub
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)] if values else 0
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест API сервера")
+    parser.add_argument('--clients', type=int, default=50, help="одновременных клиентов")
+    parser.add_argument('--requests', type=int, default=500, help="всего запросов")
+    parser.add_argument('--workers', type=int, default=8, help="исполнителей на сервере")
+    parser.add_argument('--queue', type=int, default=32, help="размер очереди сервера")
+    parser.add_argument('--latency', type=float, default=0.5, help="задержка заглушки API, с")
+    parser.add_argument('--tenants', type=int, default=10, help="интерактивных клиентов (X-Tenant)")
+    parser.add_argument('--batch-share', type=float, default=0.0,
+                        help="доля фоновых запросов от одного пакетного клиента")
+    args = parser.parse_args()
+
+    stub = start_stub(args.latency)
+    # Настройки должны быть заданы до импорта модулей приложения
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-loadtest')
+    os.environ['OPENAI_API_BASE'] = f"http://127.0.0.1:{stub.server_address[1]}/v1"
+    os.environ['NEYROTG_IMAGES_DIR'] = tempfile.mkdtemp(prefix="neyrotg_load_")
+    os.environ['NEYROTG_IMAGES_RPM'] = '100000'
+    os.environ['NEYROTG_CHAT_RPM'] = '100000'
+
+    import requests
+    from src.server.api_server import ApiServer, GenerationPipeline
+
+    pipeline = GenerationPipeline(workers=args.workers, queue_size=args.queue)
+    server = ApiServer(pipeline, host='127.0.0.1', port=0)
+    server.start()
+    base_url = f"http://127.0.0.1:{server.address[1]}"
+
+    session_local = threading.local()
+
+    def one_request(i):
+        session = getattr(session_local, 'session', None)
+        if session is None:
+            session = session_local.session = requests.Session()
+        # Смесь запросов: генерация с повторным использованием, улучшение, перевод
+        kind = i % 3
+        if kind == 0:
+            url, body = "/generate", {'description': f"load test {i % 20}", 'reuse': True}
+        elif kind == 1:
+            url, body = "/enhance", {'text': f"load test {i}"}
+        else:
+            url, body = "/translate", {'text': f"load test {i % 10}", 'langs': ['en', 'de']}
+        # Каждый N-й запрос - от пакетного клиента с фоновым приоритетом
+        if args.batch_share and (i * args.batch_share) % 1 + args.batch_share >= 1:
+            priority, headers = "batch", {'X-Tenant': "batch", 'X-Priority': "batch"}
+        else:
+            priority, headers = "interactive", {'X-Tenant': f"user{i % args.tenants}"}
+        started = time.perf_counter()
+        response = session.post(base_url + url, json=body, headers=headers, timeout=600)
+        return url, priority, response.status_code, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as clients:
+        results = list(clients.map(one_request, range(args.requests)))
+    elapsed = time.perf_counter() - started
+
+    print(f"Запросов: {len(results)} за {elapsed:.1f} с ({len(results) / elapsed:.1f} в секунду)")
+    for status in sorted({status for _, _, status, _ in results}):
+        print(f"  HTTP {status}: {sum(1 for _, _, s, _ in results if s == status)}")
+    for url in ("/generate", "/enhance", "/translate"):
+        for priority in ("interactive", "batch"):
+            latencies = [latency for u, p, status, latency in results
+                         if u == url and p == priority and status == 200]
+            if latencies:
+                print(f"  {url} [{priority}]: p50 {percentile(latencies, 50):.3f} с, "
+                      f"p95 {percentile(latencies, 95):.3f} с, p99 {percentile(latencies, 99):.3f} с")
+    print(f"Состояние сервера: {requests.get(base_url + '/health').json()}")
+
+    server.shutdown()
+    stub.shutdown()
+
+if __name__ == "__main__":
+    main()